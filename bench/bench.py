@@ -0,0 +1,201 @@
+"""
+    Benchmarks of the `vsm` and `server.py` hot paths on synthetic collections (see `corpus.py`).
+
+        python bench.py --docs 1000 10000 -o results.json
+        python bench.py --docs 1000 10000 --compare results.json
+
+    Each benchmark runs `repeat` times, the JSON output has the per operation
+    min / median / mean / p95 seconds of each (benchmark, collection size).
+    `--compare` exits with 1 if a best time (`min_s`, the least noisy) is slower than the baseline by more than `--threshold`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+
+import corpus
+
+VSM_DIR = corpus.VSM_DIR
+import vsm
+import index
+import feedback
+
+# CONSTANTS
+REPEAT = 5
+THRESHOLD = .1
+QUERIES = 100
+PAIRS = 1000
+TEXTS = 200
+FEEDBACK = 10
+K = 10
+
+def measure(fn, ops : int, repeat : int = REPEAT) -> dict:
+    """
+        Runs `fn` (doing `ops` operations) `repeat` times, returns the seconds per operation.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) / ops)
+    times = np.array(times)
+    return {
+        'ops' : ops,
+        'repeat' : repeat,
+        'min_s' : float(times.min()),
+        'median_s' : float(np.median(times)),
+        'mean_s' : float(times.mean()),
+        'p95_s' : float(np.percentile(times, 95)),
+        'ops_per_s' : float(1 / np.median(times)) if np.median(times) > 0 else None,
+    }
+
+def load_server(idx : index.Index):
+    """
+        The `server` module serving `idx`, with empty caches.
+    """
+    cwd = os.getcwd()
+    os.chdir(VSM_DIR)       # server.py loads its snapshot from the working directory
+    try:
+        import server
+    finally:
+        os.chdir(cwd)
+    server.HOLDER.wait()     # the first generation, if it is being built
+    server.HOLDER.swap(idx)
+    server.QUERY_CACHE.clear()
+    server.RESULT_CACHE.clear()
+    return server
+
+def uncached(server, client, url : str, bodies : list):
+    """
+        Posts each body of `bodies` to `url`, emptying the caches before each request.
+    """
+    def run():
+        for body in bodies:
+            server.QUERY_CACHE.clear()
+            server.RESULT_CACHE.clear()
+            if isinstance(body, str):
+                response = client.post(url, data=body, content_type='text/plain')
+            else:
+                response = client.post(url, json=body)
+            assert response.status_code == 200, response.status_code
+    return run
+
+def run(n : int, repeat : int = REPEAT, seed : int = corpus.SEED, server : bool = True, log : bool = False) -> list[dict]:
+    """
+        Every benchmark on a synthetic collection of `n` documents.
+    """
+    rng = random.Random(seed)
+    results = []
+
+    def bench(name, fn, ops, times = repeat):
+        results.append({'name' : name, 'documents' : n, **measure(fn, ops, times)})
+        if log:
+            r = results[-1]
+            print(f"{vsm.CYAN}[BENCH]{vsm.END}\t{name:<22} {n:>8} docs\t{r['median_s'] * 1e6:12.1f} us/op")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'series.json')
+        corpus.write(n, path, seed)
+        raw = vsm.load_data(path)
+        generator = corpus.Generator(raw[:2000], seed)
+
+        texts = [d[vsm.OVERVIEW] for d in rng.sample(raw, min(TEXTS, n))]
+        bench('preprocess', lambda: [vsm.preprocess(t) for t in texts], len(texts))
+
+        data = vsm.load_processed_data(path=path)
+        bench('load_processed_data', lambda: vsm.load_processed_data(path=path), n, max(1, min(repeat, 10_000 * repeat // n)))
+
+    DF = vsm.compute_df(data)
+    bench('compute_df', lambda: vsm.compute_df(data), n)
+    TF_IDF = vsm.compute_tfidf(data, DF)
+    bench('compute_tfidf', lambda: vsm.compute_tfidf(data, DF), n)
+
+    query_texts = [' '.join(generator.sample(rng.randint(1, 6))) for _ in range(QUERIES)]
+    bench('query2vec', lambda: [vsm.query2vec(q, DF, n) for q in query_texts], len(query_texts))
+
+    ids = list(TF_IDF)
+    pairs = [(TF_IDF[rng.choice(ids)], TF_IDF[rng.choice(ids)]) for _ in range(PAIRS)]
+    bench('cosine_similarity', lambda: [vsm.cosine_similarity(a, b) for a, b in pairs], len(pairs))
+
+    idx = index.Index.from_data(data)
+    queries = [vsm.query2vec(q, DF, n) for q in query_texts]
+    judgments = [(rng.sample(ids, FEEDBACK), rng.sample(ids, FEEDBACK)) for _ in queries]
+    bench('rocchio', lambda: [
+        feedback.feedback_query(idx, q, r, nr) for q, (r, nr) in zip(queries, judgments)
+    ], len(queries))
+
+    if server:
+        srv = load_server(idx)
+        client = srv.app.test_client()
+        bench('/vectorize', uncached(srv, client, '/vectorize', query_texts), len(query_texts))
+        bench('/score', uncached(srv, client, '/score', [{'query' : q, 'k' : K} for q in queries]), len(queries))
+        bench('/rf_score', uncached(srv, client, '/rf_score', [
+            {'fields' : {vsm.TITLE : q}, 'relevants' : r, 'non-relevants' : nr, 'k' : K}
+            for q, (r, nr) in zip(query_texts, judgments)
+        ]), len(query_texts))
+
+    return results
+
+def metadata(seed : int) -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=VSM_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit' : commit,
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'platform' : platform.platform(),
+        'cpus' : os.cpu_count(),
+        'seed' : seed,
+    }
+
+def compare(results : list[dict], baseline : list[dict], threshold : float = THRESHOLD) -> list[dict]:
+    """
+        The benchmarks whose best time is slower than in `baseline` by more than `threshold`.
+    """
+    before = {(r['name'], r['documents']) : r['min_s'] for r in baseline}
+    regressions = []
+    for r in results:
+        if (old := before.get((r['name'], r['documents']))) is None:
+            continue
+        ratio = r['min_s'] / old if old > 0 else float('inf')
+        flag = f'{vsm.RED}REGRESSION{vsm.END}' if ratio > 1 + threshold else ''
+        print(f"{r['name']:<22} {r['documents']:>8} docs\t{old * 1e6:12.1f} -> {r['min_s'] * 1e6:12.1f} us/op\t{ratio:6.2f}x {flag}")
+        if ratio > 1 + threshold:
+            regressions.append({**r, 'baseline_s' : old, 'ratio' : ratio})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the vsm hot paths.')
+    parser.add_argument('--docs', type=int, nargs='+', default=[1000])
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--seed', type=int, default=corpus.SEED)
+    parser.add_argument('--no-server', action='store_true', help='skip the HTTP handlers')
+    parser.add_argument('-o', '--output', default=None, help='JSON results file')
+    parser.add_argument('--compare', default=None, help='baseline JSON results file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    results = [r for n in args.docs for r in run(n, args.repeat, args.seed, not args.no_server, log=True)]
+    report = {'meta' : metadata(args.seed), 'results' : results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
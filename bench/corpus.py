@@ -0,0 +1,123 @@
+"""
+    Synthetic collections shaped like `vsm/series_data.json`, from 1k to 1M documents.
+
+    Titles & overviews are sampled word by word: most words come from the unigram
+    distribution of the real collection, the others from a **Zipf** tail of made up
+    words, so the vocabulary keeps growing with the collection size (Heaps' law) as
+    a real one would. Lengths and the other fields are sampled from real documents.
+
+        python corpus.py 100000 -o series_100k.json
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+from collections import Counter
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import vsm
+
+# CONSTANTS
+SOURCE = os.path.join(VSM_DIR, vsm.JSON_FILE)
+SEED = 42
+NEW_WORDS = .08         # share of the words drawn from the Zipf tail
+ZIPF_EXPONENT = 1.3
+CHUNK_SIZE = 10_000
+SYLLABLES = [c + v for c in 'bcdfghjklmnprstvz' for v in 'aeiou']
+
+class Generator:
+    """
+        Samples documents like the ones of `source` (a list of raw documents).
+    """
+
+    def __init__(self, source : list[dict], seed : int = SEED):
+        self.source = source
+        self.rng = np.random.default_rng(seed)
+
+        counts = Counter()
+        self.title_lengths = []
+        self.overview_lengths = []
+        for d in source:
+            title = d[vsm.TITLE].split()
+            overview = d[vsm.OVERVIEW].split()
+            counts.update(title)
+            counts.update(overview)
+            self.title_lengths.append(len(title))
+            self.overview_lengths.append(len(overview))
+
+        self.words = list(counts)
+        p = np.array(list(counts.values()), dtype=np.float64)
+        self.p = p / p.sum()
+
+    def sample(self, n : int) -> list[str]:
+        """
+            `n` words: real ones or, with probability `NEW_WORDS`, words of the Zipf tail.
+        """
+        real = self.rng.choice(len(self.words), size=n, p=self.p).tolist()
+        new = self.rng.random(n) < NEW_WORDS
+        tail = self.rng.zipf(ZIPF_EXPONENT, size=n).tolist()
+        return [made_up(tail[i]) if new[i] else self.words[real[i]] for i in range(n)]
+
+    def documents(self, n : int, start : int = 0) -> list[dict]:
+        """
+            `n` documents with docIDs from `start`.
+        """
+        templates = self.rng.integers(len(self.source), size=n).tolist()
+        title_lengths = self.rng.choice(self.title_lengths, size=n).tolist()
+        overview_lengths = self.rng.choice(self.overview_lengths, size=n).tolist()
+        words = self.sample(sum(title_lengths) + sum(overview_lengths))
+
+        docs = []
+        c = 0
+        for i in range(n):
+            doc = dict(self.source[templates[i]])
+            doc[vsm.TITLE] = ' '.join(words[c:c + title_lengths[i]]).capitalize()
+            c += title_lengths[i]
+            doc[vsm.OVERVIEW] = ' '.join(words[c:c + overview_lengths[i]]).capitalize() + '.'
+            c += overview_lengths[i]
+            doc['docID'] = start + i
+            docs.append(doc)
+        return docs
+
+def made_up(rank : int) -> str:
+    """
+        The made up word of Zipf `rank`: a distinct string of syllables for each rank.
+    """
+    word = ''
+    while rank:
+        rank, r = divmod(rank, len(SYLLABLES))
+        word += SYLLABLES[r]
+    return word + 'x'
+
+def generate(n : int, seed : int = SEED, source : str = SOURCE) -> list[dict]:
+    """
+        A synthetic collection of `n` documents.
+    """
+    generator = Generator(vsm.load_data(source), seed)
+    return [d for i in range(0, n, CHUNK_SIZE) for d in generator.documents(min(CHUNK_SIZE, n - i), i)]
+
+def write(n : int, path : str, seed : int = SEED, source : str = SOURCE) -> None:
+    """
+        Writes a synthetic collection of `n` documents to `path`, `CHUNK_SIZE`
+        documents at a time (the whole collection is never in memory).
+    """
+    generator = Generator(vsm.load_data(source), seed)
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('[')
+        for i in range(0, n, CHUNK_SIZE):
+            docs = generator.documents(min(CHUNK_SIZE, n - i), i)
+            f.write((',\n' if i else '\n') + ',\n'.join(json.dumps(d) for d in docs))
+        f.write('\n]\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a synthetic series collection.')
+    parser.add_argument('documents', type=int)
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+
+    write(args.documents, args.output or f'series_{args.documents}.json', args.seed)
@@ -0,0 +1,75 @@
+"""
+    Streaming version of `to_json.py`: converts the CSV in chunks of `CHUNK_SIZE` rows
+    into **JSON Lines** (one document per line), with the same transforms:
+        - `Genre` split on ", ".
+        - `docID` the row number.
+        - `Actors` the list of `Star1`..`Star4` (the `Star` columns are removed).
+    Empty fields are `null`, `IMDB_Rating` and `No_of_Votes` are numbers, as with pandas.
+    Only one chunk is in memory at a time.
+
+        python to_jsonl.py [--csv series_data.csv] [-o series_data.jsonl]
+"""
+import csv
+import json
+import argparse
+
+from itertools import islice
+
+CSV_PATH = "./series_data.csv"
+JSONL_PATH = "./series_data.jsonl"
+CHUNK_SIZE = 1000
+STARS = ['Star1', 'Star2', 'Star3', 'Star4']
+NUMBERS = {'IMDB_Rating': float, 'No_of_Votes': int}
+
+def iter_chunks(path : str = CSV_PATH, chunk_size : int = CHUNK_SIZE):
+    """
+        Yields the rows of the CSV `path` as lists of (at most) `chunk_size` dictionaries.
+    """
+    with open(path, 'r', encoding='utf8', newline='') as f:
+        rows = csv.DictReader(f)
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+
+def transform(row : dict, doc_id : int) -> dict:
+    """
+        The JSON document of the CSV `row`, as written by `to_json.py`.
+    """
+    doc = {}
+    for column, value in row.items():
+        if column in STARS:
+            continue
+        if value == '':
+            doc[column] = None
+        elif column in NUMBERS:
+            doc[column] = NUMBERS[column](value.replace(',', ''))
+        elif column == 'Genre':
+            doc[column] = value.split(", ")
+        else:
+            doc[column] = value
+    doc['docID'] = doc_id
+    doc['Actors'] = [row[s] or None for s in STARS]
+    return doc
+
+def convert(csv_path : str = CSV_PATH, jsonl_path : str = JSONL_PATH, chunk_size : int = CHUNK_SIZE) -> int:
+    """
+        Writes the documents of `csv_path` in `jsonl_path`, returns their number.
+    """
+    doc_id = 0
+    with open(jsonl_path, 'w', encoding='utf8') as out:
+        for chunk in iter_chunks(csv_path, chunk_size):
+            lines = []
+            for row in chunk:
+                lines.append(json.dumps(transform(row, doc_id)))
+                doc_id += 1
+            out.write('\n'.join(lines) + '\n')
+    return doc_id
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Converts the CSV dataset into JSON Lines, chunk by chunk.')
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('-o', '--output', default=JSONL_PATH)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    n = convert(args.csv, args.output, args.chunk_size)
+    print(f'{n} documents written in {args.output}')
@@ -0,0 +1,217 @@
+"""
+Vectorised evaluation of ranked result lists.
+
+The relevance of every (system, query, rank) is computed once, as a boolean
+matrix of shape (systems, queries, depth); every metric is then a cumulative
+sum (or max) along the rank axis, for all queries, cutoffs and systems at once.
+Nothing here plots: see `evaluation.py` for the plots.
+
+    python eval_engine.py --run solr=solr_run.json --run rf=rf_run.txt --depth 20
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+from parse_responses import parse_responses, RF_DIR
+
+DEPTH = 20
+RECALL_LEVELS = np.linspace(0, 1, 11)
+
+
+def load_run(path: str) -> dict:
+    """
+    Loads the results of a system as a dict of <query, ranked list of docIDs>, from:
+        - a `.json` file: {"query": [docID, ...], ...}
+        - a TREC run file: `query Q0 docID rank score tag` lines, queries may not contain spaces.
+    """
+    if os.path.splitext(path)[1] == '.json':
+        with open(path, 'r', encoding='utf8') as f:
+            return {q: [int(d) for d in docs] for q, docs in json.load(f).items()}
+
+    rows = {}
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            query, _, doc_id, rank, *_ = line.split()
+            rows.setdefault(query, []).append((int(rank), int(doc_id)))
+    return {q: [d for _, d in sorted(r)] for q, r in rows.items()}
+
+
+def results_matrix(results: dict, queries: list, depth: int) -> np.ndarray:
+    """
+    The (queries, depth) matrix of the docIDs of `results`, padded with -1.
+    """
+    matrix = np.full((len(queries), depth), -1, dtype=np.int64)
+    for i, q in enumerate(queries):
+        docs = results.get(q, [])[:depth]
+        matrix[i, :len(docs)] = docs
+    return matrix
+
+
+def relevance_matrix(runs: np.ndarray, relevants: dict, queries: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Given the (..., queries, depth) docIDs of `runs` returns:
+        - the boolean matrix of the relevant results, same shape of `runs`.
+        - the number of relevant documents of each query.
+    Membership is tested once for all the (query, docID) pairs with `np.isin`.
+    """
+    n_relevant = np.array([len(set(relevants.get(q, []))) for q in queries], dtype=np.int64)
+    relevant_ids = [np.unique(np.asarray(relevants.get(q, []), dtype=np.int64)) for q in queries]
+    stride = max([int(runs.max(initial=0))] + [int(r.max(initial=0)) for r in relevant_ids]) + 2
+
+    # (query, docID) -> query * stride + docID + 1, padding (-1) maps to an unused key
+    relevant_keys = np.concatenate(
+        [i * stride + r + 1 for i, r in enumerate(relevant_ids)] + [np.empty(0, dtype=np.int64)]
+    )
+    run_keys = np.arange(len(queries), dtype=np.int64)[:, None] * stride + runs + 1
+    is_relevant = np.isin(run_keys, relevant_keys) & (runs >= 0)
+    return is_relevant, n_relevant
+
+
+def precision_at(is_relevant: np.ndarray) -> np.ndarray:
+    """
+    P@k for every k = 1..depth, along the last axis.
+    """
+    return np.cumsum(is_relevant, axis=-1) / np.arange(1, is_relevant.shape[-1] + 1)
+
+
+def recall_at(is_relevant: np.ndarray, n_relevant: np.ndarray) -> np.ndarray:
+    """
+    R@k for every k = 1..depth, along the last axis (0 for queries without relevant documents).
+    """
+    hits = np.cumsum(is_relevant, axis=-1)
+    return np.divide(hits, n_relevant[:, None], out=np.zeros(hits.shape), where=n_relevant[:, None] > 0)
+
+
+def interpolated_precision(precision: np.ndarray, recall: np.ndarray, levels: np.ndarray = RECALL_LEVELS) -> np.ndarray:
+    """
+    Interpolated precision at each recall level: the max P@k with R@k >= level (0 if never reached).
+    """
+    # Max precision from k onward, then the first k reaching each level
+    tail_max = np.maximum.accumulate(precision[..., ::-1], axis=-1)[..., ::-1]
+    first = (recall[..., None, :] < levels[:, None]).sum(axis=-1)
+    padded = np.concatenate([tail_max, np.zeros(tail_max.shape[:-1] + (1,))], axis=-1)
+    return np.take_along_axis(padded, first, axis=-1)
+
+
+def average_precision(is_relevant: np.ndarray, n_relevant: np.ndarray, retrieved_only: bool = False) -> np.ndarray:
+    """
+    AP of each query: sum of P@k at the relevant ranks over the number of relevant documents
+    (over the relevant retrieved ones if `retrieved_only`, the convention of the evaluation plots).
+    """
+    hits = (precision_at(is_relevant) * is_relevant).sum(axis=-1)
+    denominator = is_relevant.sum(axis=-1) if retrieved_only else np.broadcast_to(n_relevant, hits.shape)
+    return np.divide(hits, denominator, out=np.zeros(hits.shape), where=denominator > 0)
+
+
+def ndcg_at(is_relevant: np.ndarray, n_relevant: np.ndarray) -> np.ndarray:
+    """
+    nDCG@k (binary gains) for every k = 1..depth, along the last axis.
+    """
+    depth = is_relevant.shape[-1]
+    discount = 1 / np.log2(np.arange(2, depth + 2))
+    dcg = np.cumsum(is_relevant * discount, axis=-1)
+
+    # Ideal DCG@k: the first min(k, relevants) ranks are all relevant
+    ideal = np.concatenate([[0.], np.cumsum(discount)])
+    idcg = ideal[np.minimum(np.arange(1, depth + 1), n_relevant[:, None])]
+    return np.divide(dcg, idcg, out=np.zeros(dcg.shape), where=idcg > 0)
+
+
+def evaluate(
+    runs: dict,
+    relevants: dict,
+    depth: int = DEPTH,
+    queries: list | None = None,
+    levels: np.ndarray = RECALL_LEVELS,
+    retrieved_only: bool = False,
+) -> dict:
+    """
+    Evaluates many systems at once.
+    Args:
+        `runs`: dict of <system, dict of <query, ranked list of docIDs>>
+        `relevants`: dict of <query, list of relevant docIDs>
+        `depth`: the largest cutoff k
+        `queries`: the evaluated queries, by default the judged ones
+        `levels`: recall levels of the interpolated precision
+        `retrieved_only`: AP over the relevant retrieved documents (see `average_precision`)
+    Returns:
+        A dict of <system, metrics>, per query arrays have one row per query (in `queries` order):
+            `precision`, `recall`, `ndcg`: (queries, depth), `interpolated`: (queries, levels), `ap`: (queries,)
+        and their means over the queries with at least one relevant document:
+            `mean_precision`, `mean_recall`, `mean_ndcg`, `mean_interpolated`, `map`.
+    """
+    queries = sorted(relevants) if queries is None else list(queries)
+    systems = list(runs)
+    matrix = np.stack([results_matrix(runs[s], queries, depth) for s in systems])
+
+    is_relevant, n_relevant = relevance_matrix(matrix, relevants, queries)
+    precision = precision_at(is_relevant)
+    recall = recall_at(is_relevant, n_relevant)
+    interpolated = interpolated_precision(precision, recall, levels)
+    ap = average_precision(is_relevant, n_relevant, retrieved_only)
+    ndcg = ndcg_at(is_relevant, n_relevant)
+
+    judged = n_relevant > 0
+    report = {}
+    for i, s in enumerate(systems):
+        report[s] = {
+            'queries': queries,
+            'levels': levels,
+            'precision': precision[i],
+            'recall': recall[i],
+            'interpolated': interpolated[i],
+            'ap': ap[i],
+            'ndcg': ndcg[i],
+            'mean_precision': precision[i][judged].mean(axis=0) if judged.any() else np.zeros(depth),
+            'mean_recall': recall[i][judged].mean(axis=0) if judged.any() else np.zeros(depth),
+            'mean_interpolated': interpolated[i][judged].mean(axis=0) if judged.any() else np.zeros(len(levels)),
+            'mean_ndcg': ndcg[i][judged].mean(axis=0) if judged.any() else np.zeros(depth),
+            'map': float(ap[i][judged].mean()) if judged.any() else 0.,
+        }
+    return report
+
+
+def summary(report: dict, cutoffs: tuple = (5, 10, 20)) -> dict:
+    """
+    JSON friendly summary of `evaluate`: MAP, P@k, R@k and nDCG@k of each system at `cutoffs`.
+    """
+    result = {}
+    for s, m in report.items():
+        depth = len(m['mean_precision'])
+        result[s] = {'map': m['map']}
+        for k in cutoffs:
+            if k <= depth:
+                result[s][f'P@{k}'] = float(m['mean_precision'][k - 1])
+                result[s][f'R@{k}'] = float(m['mean_recall'][k - 1])
+                result[s][f'nDCG@{k}'] = float(m['mean_ndcg'][k - 1])
+    return result
+
+
+def load_relevants() -> dict:
+    """
+    The union of the Solr and relevance feedback judgments, as `evaluation.load_relevats`.
+    """
+    solr = parse_responses()
+    rf = parse_responses(dir=RF_DIR)
+    return {q: sorted(set(solr.get(q, []) + rf.get(q, []))) for q in set(solr) | set(rf)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluates ranked runs against the relevance judgments.')
+    parser.add_argument('--run', action='append', required=True, help='system=path of a JSON or TREC run')
+    parser.add_argument('--qrels', default=None, help='JSON {query: [docIDs]}, the judgments/ csv by default')
+    parser.add_argument('--depth', type=int, default=DEPTH)
+    args = parser.parse_args()
+
+    if args.qrels:
+        with open(args.qrels, 'r', encoding='utf8') as f:
+            relevants = json.load(f)
+    else:
+        relevants = load_relevants()
+
+    runs = dict(r.split('=', 1) for r in args.run)
+    report = evaluate({s: load_run(p) for s, p in runs.items()}, relevants, args.depth)
+    print(json.dumps(summary(report), indent=2))
@@ -0,0 +1,74 @@
+import os
+import sys
+import numpy as np
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import index
+import holder
+from test_top_k import KS, collection, random_queries, rocchio_queries, assert_same_ranking
+
+
+def closing(monkeypatch) -> list:
+    """
+    Records the indexes closed by `index.Index.close`, in order.
+    """
+    closed = []
+    close = index.Index.close
+
+    def recording(self):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(index.Index, 'close', recording)
+    return closed
+
+
+def test_swap_closes_drained_generation(monkeypatch):
+    closed = closing(monkeypatch)
+    swapped = []
+    first, second, third = collection(seed=16), collection(seed=17), collection(seed=18)
+    h = holder.IndexHolder(first, on_swap=swapped.append)
+    assert (h.index, h.generation) == (first, 1)
+
+    h.swap(second)
+    assert closed == [first]            # no request on the first generation
+    assert second.version > first.version
+    assert swapped == [first, second]
+
+
+def test_release_closes_replaced_generation(monkeypatch):
+    closed = closing(monkeypatch)
+    first, second = collection(seed=16), collection(seed=17)
+    h = holder.IndexHolder(first)
+
+    with h.use() as idx:
+        other = h.acquire()
+        assert idx is other is first
+        h.swap(second)
+        assert h.acquire() is second
+        h.release(other)
+        assert closed == []             # still in use
+    assert closed == [first]            # its last request is done
+
+    h.release(second)
+    assert closed == [first]            # the current generation stays open
+
+
+def test_sharded_scores():
+    idx = collection(seed=19)
+    idx.n_shards = 2
+    try:
+        for query in random_queries(idx, seed=20) + rocchio_queries(idx, seed=21):
+            expected = idx.score(query, backend='csr')
+            result = idx.score(query, backend='sharded')
+            assert result.keys() == expected.keys()
+            assert np.allclose([result[d] for d in expected], list(expected.values()))
+            for k in KS:
+                assert_same_ranking(
+                    list(idx.score(query, k, backend='sharded').items()),
+                    list(idx.score(query, k, backend='csr').items())
+                )
+    finally:
+        idx.close()
+    assert idx._sharded is None
@@ -0,0 +1,83 @@
+import os
+import sys
+import numpy as np
+
+from nltk.corpus import stopwords
+from nltk.tokenize import word_tokenize
+from nltk.stem import PorterStemmer
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import vsm
+import cache
+
+EDGE_CASES = [
+    '',
+    'The',
+    "It's a man's world, isn't it?",
+    'Don\'t stop... "believing"!',
+    'cannot gonna wanna gimme lemme',
+    'Rock & Roll: 1960-1970 (part #2)',
+    'A “quoted” title – with dashes — and… ellipsis',
+    'e-mail@domain.com £100 50° {braces} [brackets] back\\slash',
+    'Line\nbreak\tand   spaces',
+    'UPPER lower MiXeD running runs ran',
+]
+
+
+def legacy_preprocess(text: str) -> np.ndarray:
+    """
+    The numpy char chain `vsm.preprocess` used to be.
+    """
+    def remove_punctuation(text):
+        for s in '!"#$%&()*+-./:;<=>?@[]\\^_~`{}|\n£°':
+            text = np.char.replace(text, s, '')
+        return np.char.replace(text, ',', '')
+
+    def remove_stopwords(text):
+        stop_words = stopwords.words('english')
+        return np.array(' '.join([w for w in word_tokenize(str(text)) if not w in stop_words]))
+
+    def stemming(text):
+        stemmer = PorterStemmer()
+        return np.array(' '.join([stemmer.stem(w) for w in word_tokenize(str(text))]))
+
+    text = np.char.lower(text)
+    text = remove_punctuation(text)
+    text = np.char.replace(text, "'", '')
+    text = remove_stopwords(text)
+    text = stemming(text)
+    text = remove_punctuation(text)
+    text = np.char.replace(text, "'", '')
+    return text
+
+
+def legacy_tokens(text: str) -> list[str]:
+    return word_tokenize(str(legacy_preprocess(text)))
+
+
+def test_tokenize_edge_cases():
+    for text in EDGE_CASES:
+        assert vsm.tokenize(text) == legacy_tokens(text), text
+
+
+def test_tokenize_collection():
+    data = vsm.load_data(os.path.join(VSM_DIR, vsm.JSON_FILE))
+    texts = [d[vsm.TITLE] for d in data] + [d[vsm.OVERVIEW] for d in data]
+    assert vsm.tokenize_batch(texts) == [legacy_tokens(t) for t in texts]
+
+
+def test_preprocess():
+    for text in EDGE_CASES:
+        assert word_tokenize(str(vsm.preprocess(text))) == legacy_tokens(text), text
+
+
+def test_cache_key():
+    # texts with the same cache key must have the same query vector
+    texts = EDGE_CASES + ['war soldiers', 'war\nsoldiers', 'War\tsoldiers', ' war,  soldiers! ']
+    for a in texts:
+        for b in texts:
+            if cache.normalise(a) == cache.normalise(b):
+                assert vsm.tokenize(a) == vsm.tokenize(b), (a, b)
+    assert cache.normalise('war\nsoldiers') != cache.normalise('war soldiers')
+    assert cache.normalise('War\tsoldiers') == cache.normalise(' war,  soldiers! ')
@@ -0,0 +1,77 @@
+import os
+import sys
+import pytest
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import index
+import cache
+import sessions
+
+
+@pytest.fixture(scope='module')
+def server():
+    """
+    The `server` module, with its first index generation loaded.
+    """
+    cwd = os.getcwd()
+    os.chdir(VSM_DIR)       # server.py loads (or builds) its snapshot from the working directory
+    try:
+        import server
+        server.HOLDER.wait()
+    finally:
+        os.chdir(cwd)
+    return server
+
+
+def test_score_batch_failing_query(server, monkeypatch):
+    score_batch = index.Index.score_batch
+
+    def failing(self, queries, k=-1):
+        if any('boom' in q for q in queries):
+            raise ValueError('boom')
+        return score_batch(self, queries, k)
+
+    monkeypatch.setattr(index.Index, 'score_batch', failing)
+    server.RESULT_CACHE.clear()
+    client = server.app.test_client()
+    queries = [{'war': 1.}, {'boom': 1.}, {'hero': 1., 'war': .5}]
+    response = client.post('/score_batch', json={'queries': [{'query': q} for q in queries], 'k': 5})
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[1] == {'error': 'ValueError: boom'}
+    for i in (0, 2):
+        assert results[i]['result'] == client.post('/score', json={'query': queries[i], 'k': 5}).get_json()
+
+
+def test_score_cache_shared_with_batch(server, monkeypatch):
+    server.RESULT_CACHE.clear()
+    client = server.app.test_client()
+    query = {'war': 1., 'hero': .5}
+    expected = client.post('/score', json={'query': query, 'k': 5}).get_json()
+
+    # served out of the cache of `/score`: the batch scoring is not run
+    monkeypatch.setattr(index.Index, 'score_batch', lambda *args, **kwargs: pytest.fail('scored again'))
+    response = client.post('/score_batch', json={'queries': [{'query': query}], 'k': 5})
+    assert response.get_json()['results'] == [{'result': expected}]
+
+
+def test_session_over_budget(server, monkeypatch):
+    monkeypatch.setattr(server, 'SESSIONS', sessions.SessionStore(max_bytes=256))
+    client = server.app.test_client()
+    response = client.post('/sessions', json={'fields': {'Series_Title': 'war', 'Overview': 'a hero at war'}})
+    assert response.status_code == 413
+    assert server.SESSIONS.stats()['entries'] == 0
+
+
+def test_session_ttl_restarts_on_access(monkeypatch):
+    now = [0.]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    store = sessions.SessionStore(ttl=10)
+    session_id = store.create('session')
+    for _ in range(3):
+        now[0] += 8
+        assert store.get(session_id) == 'session'
+    now[0] += 11
+    assert store.get(session_id) is None
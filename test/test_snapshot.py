@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import vsm
+import index
+import compressed
+import snapshot
+from test_top_k import KS, collection, random_queries, rocchio_queries
+
+SERIES = [
+    {'docID': 0, vsm.TITLE: 'Game of Thrones', vsm.OVERVIEW: 'Nine noble families fight for control over the lands of Westeros.'},
+    {'docID': 1, vsm.TITLE: 'Breaking Bad', vsm.OVERVIEW: 'A chemistry teacher turns to manufacturing drugs.'},
+    {'docID': 2, vsm.TITLE: 'The Wire', vsm.OVERVIEW: 'The drug scene in Baltimore through the eyes of dealers and police.'},
+]
+
+
+def assert_tied_ranking(rank: list[tuple], expected: list[tuple], scores: dict):
+    """
+    Same scores position by position, the docIDs can differ only where their `scores`
+    tie up to rounding errors (the dict and the array backends sum in different orders).
+    """
+    assert np.allclose([s for _, s in rank], [s for _, s in expected])
+    for (d, _), (e, _) in zip(rank, expected):
+        assert d == e or np.isclose(scores[d], scores[e], rtol=0, atol=1e-12)
+
+
+@pytest.fixture
+def mapped(tmp_path) -> tuple[index.Index, index.Index]:
+    """
+    An index of `collection` and the mapped index of its snapshot.
+    """
+    idx = collection(seed=12)
+    path = str(tmp_path / 'collection.idx')
+    snapshot.write(path, idx, 'digest')
+    return idx, index.Index.from_snapshot(snapshot.load(path, check=False))
+
+
+def test_mapped_scores(mapped):
+    idx, mapped_idx = mapped
+    assert mapped_idx.mapped
+    for query in random_queries(idx, seed=13) + rocchio_queries(idx, seed=14):
+        expected = idx.score(query)
+        result = mapped_idx.score(query)
+        assert result.keys() == expected.keys()
+        assert np.allclose([result[d] for d in expected], list(expected.values()))
+        for k in KS:
+            assert_tied_ranking(list(mapped_idx.score(query, k).items()), list(idx.score(query, k).items()), expected)
+
+
+def test_compressed_round_trip(mapped):
+    idx, mapped_idx = mapped
+    built = compressed.CompressedPostings(idx.csr_model())
+    stored = mapped_idx.compressed_postings()
+    assert stored.vocabulary.keys() == built.vocabulary.keys()
+    for t in built.vocabulary:
+        rows, weights = built.postings(built.vocabulary[t])
+        stored_rows, stored_weights = stored.postings(stored.vocabulary[t])
+        assert np.array_equal(stored.doc_ids[stored_rows], built.doc_ids[rows])
+        assert np.allclose(stored_weights, weights)
+
+    # approximate scores: at most half an impact unit of error on each weight
+    for query in random_queries(idx, seed=15):
+        exact = idx.score(query)
+        approximate = mapped_idx.score(query, backend='compressed')
+        assert np.allclose([approximate[d] for d in exact], list(exact.values()), atol=1e-2)
+
+
+def test_version_mismatch(tmp_path, monkeypatch):
+    source = str(tmp_path / 'series.json')
+    path = str(tmp_path / 'series.idx')
+    with open(source, 'w') as f:
+        json.dump(SERIES, f)
+
+    built = snapshot.build(path, source)
+    assert built.collection_size == len(SERIES)
+    assert snapshot.load(path, source) is not None
+
+    monkeypatch.setattr(snapshot, 'VERSION', snapshot.VERSION + 1)
+    assert snapshot.load(path, source) is None
+    rebuilt = snapshot.load_or_build(path, source)
+    assert rebuilt is not None and rebuilt.collection_size == len(SERIES)
+    assert snapshot.load(path, source) is not None      # written with the new version
+
+
+def test_failed_build_cleanup(tmp_path, monkeypatch):
+    source = str(tmp_path / 'series.json')
+    with open(source, 'w') as f:
+        json.dump(SERIES, f)
+    output = tmp_path / 'output'
+    output.mkdir()
+
+    def failing(*args):
+        raise MemoryError('second pass')
+
+    monkeypatch.setattr(compressed, 'quantise_impacts', failing)
+    with pytest.raises(MemoryError):
+        snapshot.build(str(output / 'series.idx'), source)
+    assert os.listdir(output) == []         # neither the spool nor the partial snapshot
@@ -0,0 +1,124 @@
+import os
+import sys
+import random
+import numpy as np
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import vsm
+import index
+import feedback
+
+KS = [1, 3, 10, 50]
+
+
+def collection(seed: int = 0, n_docs: int = 400, n_terms: int = 300) -> index.Index:
+    """
+    Index of `n_docs` random processed documents (some of them empty), their terms drawn
+    with a Zipf law out of `n_terms`; a few are duplicated so that some scores tie.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f't{i}' for i in range(n_terms)]
+    zipf = [1 / (i + 1) for i in range(n_terms)]
+    data = []
+    for doc_id in range(n_docs):
+        tokens = rng.choices(vocabulary, zipf, k=rng.randint(0, 12))
+        data.append({'docID': doc_id, 'title_tokens': tokens[:2], 'overview_tokens': tokens[2:]})
+    for d in rng.sample(data, 40):
+        data.append({**d, 'docID': n_docs + d['docID']})
+    return index.Index.from_data(data)
+
+
+def top_k(query: dict, k: int, idx: index.Index) -> list[tuple] | None:
+    return vsm.top_k(query, k, idx.tf_idf, idx.postings, idx.norms, idx.max_weights)
+
+
+def exhaustive(query: dict, k: int, idx: index.Index) -> list[tuple]:
+    """
+    The top `k` of every non empty document, by decreasing score and increasing docID.
+    """
+    scores = dict.fromkeys(idx.norms, 0.)
+    scores.update(vsm.score(query, idx.postings, idx.norms))
+    return sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:k]
+
+
+def assert_same_ranking(rank: list[tuple], expected: list[tuple]):
+    assert [d for d, _ in rank] == [d for d, _ in expected]
+    assert np.allclose([s for _, s in rank], [s for _, s in expected])
+
+
+def random_queries(idx: index.Index, seed: int = 1, n: int = 50) -> list[dict]:
+    rng = random.Random(seed)
+    terms = sorted(idx.df) + ['unknown']
+    return [
+        {t: rng.choice([1., rng.random() * 3]) for t in rng.sample(terms, rng.randint(1, 6))}
+        for _ in range(n)
+    ]
+
+
+def rocchio_queries(idx: index.Index, seed: int = 2, n: int = 30) -> list[dict]:
+    """
+    Rocchio expansions of random queries, long and with negative weights.
+    """
+    rng = random.Random(seed)
+    docs = [d for d, vec in idx.tf_idf.items() if vec]
+    queries = []
+    for q in random_queries(idx, seed, n):
+        relevants = [idx.tf_idf[d] for d in rng.sample(docs, 4)]
+        non_relevants = [idx.tf_idf[d] for d in rng.sample(docs, 2)]
+        queries.append(feedback.rocchio(q, relevants, non_relevants))
+    return queries
+
+
+def test_top_k_random_queries():
+    idx = collection()
+    for query in random_queries(idx):
+        for k in KS:
+            if (rank := top_k(query, k, idx)) is not None:
+                assert_same_ranking(rank, exhaustive(query, k, idx))
+
+
+def test_top_k_long_queries(monkeypatch):
+    # the pruning has to be exact past the length cutoff too
+    monkeypatch.setattr(vsm, 'TOP_K_MAX_TERMS', 10 ** 6)
+    idx = collection(seed=3)
+    for query in rocchio_queries(idx):
+        for k in KS:
+            if (rank := top_k(query, k, idx)) is not None:
+                assert_same_ranking(rank, exhaustive(query, k, idx))
+
+
+def test_top_k_negative_weights():
+    idx = collection(seed=5)
+    rng = random.Random(7)
+    for query in random_queries(idx, seed=8):
+        for t in rng.sample(sorted(query), len(query) // 2):
+            query[t] = -query[t]
+        for k in KS:
+            if (rank := top_k(query, k, idx)) is not None:
+                assert_same_ranking(rank, exhaustive(query, k, idx))
+
+
+def test_top_k_cutoff():
+    idx = collection()
+    long_query = {t: 1. for t in list(idx.postings)[:vsm.TOP_K_MAX_TERMS + 1]}
+    assert top_k(long_query, 10, idx) is None
+
+
+def test_index_score_ties():
+    idx = collection(seed=4)
+    for query in random_queries(idx, seed=5) + rocchio_queries(idx, seed=6):
+        for k in KS:
+            expected = exhaustive(query, k, idx)
+            assert_same_ranking(list(idx.score(query, k).items()), expected)
+            idx.csr_model()         # long queries go through the CSR matrix once it is built
+            assert_same_ranking(list(idx.score(query, k).items()), expected)
+            idx._csr = None
+
+
+def test_index_score_k_zero():
+    idx = collection(seed=7)
+    query = random_queries(idx, seed=8, n=1)[0]
+    for backend in ('postings', 'csr', 'compressed'):
+        assert idx.score(query, 0, backend) == {}
+    assert idx.score_batch([query, query], [0, 3])[0] == {}
@@ -0,0 +1,64 @@
+import os
+import sys
+import random
+import numpy as np
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import vsm
+import index
+import vector
+import feedback
+import snapshot
+from test_top_k import collection, random_queries
+
+
+def random_vectors(vocabulary: vector.Vocabulary, seed: int = 0, n: int = 20) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {t: rng.uniform(-1, 2) for t in rng.sample(vocabulary.terms, rng.randint(0, 8))}
+        for _ in range(n)
+    ]
+
+
+def assert_same_vector(vec: vector.SparseVector, expected: dict, vocabulary: vector.Vocabulary):
+    assert np.all(np.diff(vec.ids) > 0)
+    result = vec.to_dict(vocabulary)
+    assert result.keys() == expected.keys()
+    assert np.allclose([result[t] for t in expected], list(expected.values()), atol=1e-6)
+
+
+def test_sparse_vector_arithmetic():
+    vocabulary = vector.Vocabulary([f't{i}' for i in range(30)])
+    dicts = random_vectors(vocabulary)
+    vectors = [vector.SparseVector.from_dict(d, vocabulary) for d in dicts]
+    for (a, x), (b, y) in zip(zip(dicts, vectors), zip(dicts[1:], vectors[1:])):
+        assert_same_vector(x + y, vsm.add(a, b), vocabulary)
+        assert_same_vector(x - y, vsm.sub(a, b), vocabulary)
+        assert_same_vector(x * 2.5, vsm.mult(a, 2.5), vocabulary)
+        assert np.isclose(x.dot(y), sum(w * b.get(t, 0) for t, w in a.items()), atol=1e-5)
+        assert np.isclose(x.norm(), np.linalg.norm(list(a.values())) if a else 0., atol=1e-5)
+    assert_same_vector(vector.mean(vectors), vsm.mean(dicts), vocabulary)
+
+
+def test_sparse_rocchio(tmp_path):
+    idx = collection(seed=9)
+    path = str(tmp_path / 'collection.idx')
+    snapshot.write(path, idx, 'digest')
+    mapped = index.Index.from_snapshot(snapshot.load(path, check=False))
+
+    rng = random.Random(10)
+    docs = sorted(idx.norms) + [10 ** 6]        # an unknown document too
+    for query in random_queries(idx, seed=11):
+        relevants, non_relevants = rng.sample(docs, rng.randint(0, 5)), rng.sample(docs, rng.randint(0, 3))
+        expected = feedback.rocchio(
+            query,
+            list(feedback.get_vectors(idx, relevants).values()),
+            list(feedback.get_vectors(idx, non_relevants).values())
+        )
+        for i in (idx, mapped):
+            result = feedback.sparse_rocchio(i, query, relevants, non_relevants)
+            assert result.keys() == expected.keys()
+            assert np.allclose([result[t] for t in expected], list(expected.values()), atol=1e-6)
+        assert feedback.feedback_query(mapped, query, relevants, non_relevants).keys() == expected.keys()
+    assert mapped.mapped
@@ -0,0 +1,207 @@
+"""
+Rocchio parameter sweep driven by the relevance judgments.
+
+For each judged query the initial ranking of the vsm index gives the feedback
+window: its judged relevant documents are the relevants, the others the
+non-relevants. Each configuration (alpha, beta, gamma, expansion size) expands
+every query, the expanded queries are scored together with one sparse product,
+and all the configurations are evaluated at once by `eval_engine`.
+Runs are evaluated on the **residual collection**: the feedback window of each
+query is removed from its runs (the baseline too) and from its judgments, so a
+configuration is not rewarded for ranking back the documents the user marked.
+Queries without relevant documents outside their window are not evaluated.
+The index is loaded once per worker process from the vsm snapshot.
+
+    python tune_rocchio.py --alpha .3 1 --beta .3 .75 --gamma 0 .15 .3 --max-terms 0 20
+    python tune_rocchio.py --random 200 -o sweep.json
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import itertools
+
+from concurrent.futures import ProcessPoolExecutor
+
+from eval_engine import evaluate, summary, load_relevants
+
+VSM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vsm')
+sys.path.insert(0, VSM_DIR)
+import vsm
+import index
+import snapshot
+import feedback
+
+DEPTH = 20
+FEEDBACK_WINDOW = 10
+CHUNK = 8
+GRID = {
+    'alpha': [.3, 1.],
+    'beta': [.3, .5, .75],
+    'gamma': [0., .15, .3],
+    'max_terms': [None, 10, 30],
+}
+
+INDEX = None
+
+
+def load_index() -> index.Index:
+    """
+    The index of the collection, from the vsm snapshot (built if missing).
+    """
+    path = os.path.join(VSM_DIR, snapshot.SNAPSHOT_FILE)
+    source = os.path.join(VSM_DIR, vsm.JSON_FILE)
+    return index.Index.from_snapshot(snapshot.load_or_build(path, source), refresh_every=None)
+
+
+def init_worker() -> None:
+    global INDEX
+    if INDEX is None:
+        INDEX = load_index()
+
+
+def feedback_sets(idx: index.Index, queries: list, relevants: dict, window: int = FEEDBACK_WINDOW) -> dict:
+    """
+    The simulated user feedback of each query: dict of <query, (query vector, relevants, non-relevants)>
+    from the top `window` documents of the initial ranking (the feedback window is relevants + non-relevants).
+    """
+    vectors = [vsm.query2vec(q, idx.df, idx.collection_size) for q in queries]
+    rankings = idx.score_batch(vectors, window)
+    sets = {}
+    for q, vec, ranking in zip(queries, vectors, rankings):
+        judged = set(relevants.get(q, []))
+        top = list(ranking)
+        sets[q] = (vec, [d for d in top if d in judged], [d for d in top if d not in judged])
+    return sets
+
+
+def residual(ranking, feedback_window: set, depth: int = DEPTH) -> list:
+    """
+    The top `depth` docIDs of `ranking` that are not in the feedback window.
+    """
+    return [d for d in ranking if d not in feedback_window][:depth]
+
+
+def residual_relevants(relevants: dict, sets: dict) -> dict:
+    """
+    The judgments of each query of `sets` without the documents of its feedback window.
+    """
+    return {
+        q: [d for d in relevants.get(q, []) if d not in set(rel) | set(non_rel)]
+        for q, (_, rel, non_rel) in sets.items()
+    }
+
+
+def run_configs(configs: list, sets: dict, depth: int = DEPTH) -> list:
+    """
+    The residual runs (dict of <query, ranked docIDs>) of each configuration, scored in one batch:
+    `depth` + window documents are retrieved, so that `depth` are left once the window is removed.
+    """
+    queries = list(sets)
+    windows = [set(rel) | set(non_rel) for _, rel, non_rel in sets.values()]
+    expanded = [
+        feedback.feedback_query(INDEX, vec, rel, non_rel, **config)
+        for config in configs
+        for vec, rel, non_rel in sets.values()
+    ]
+    rankings = INDEX.score_batch(expanded, [depth + len(w) for _ in configs for w in windows])
+    return [
+        {q: residual(rankings[i * len(queries) + j], windows[j], depth) for j, q in enumerate(queries)}
+        for i in range(len(configs))
+    ]
+
+
+def grid(space: dict) -> list:
+    """
+    Every combination of the values of `space`.
+    """
+    return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+
+def random_search(n: int, seed: int = 0, max_terms: list | None = None) -> list:
+    """
+    `n` configurations with alpha, beta, gamma uniform in [0, 1] and a random expansion size.
+    """
+    rng = random.Random(seed)
+    sizes = max_terms or GRID['max_terms']
+    return [
+        {
+            'alpha': rng.random(),
+            'beta': rng.random(),
+            'gamma': rng.random(),
+            'max_terms': rng.choice(sizes),
+        }
+        for _ in range(n)
+    ]
+
+
+def sweep(
+    configs: list,
+    queries: list | None = None,
+    depth: int = DEPTH,
+    window: int = FEEDBACK_WINDOW,
+    workers: int | None = None,
+) -> list:
+    """
+    Evaluates each configuration on `queries` (all the judged ones by default) over the
+    residual collection, returns them with their MAP, P@k, R@k and nDCG@k sorted by MAP.
+    The baseline (no feedback) is reported with `config` None.
+    """
+    init_worker()
+    relevants = load_relevants()
+    queries = [q for q in (queries or sorted(relevants)) if relevants.get(q)]
+    sets = feedback_sets(INDEX, queries, relevants, window)
+    relevants = residual_relevants(relevants, sets)
+    queries = [q for q in queries if relevants[q]]
+    sets = {q: sets[q] for q in queries}
+
+    chunks = [configs[i:i + CHUNK] for i in range(0, len(configs), CHUNK)]
+    if workers == 1:
+        runs = [run for chunk in chunks for run in run_configs(chunk, sets, depth)]
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+            runs = [run for result in pool.map(run_configs, chunks, itertools.repeat(sets), itertools.repeat(depth)) for run in result]
+
+    windows = [set(rel) | set(non_rel) for _, rel, non_rel in sets.values()]
+    initial = INDEX.score_batch([vec for vec, _, _ in sets.values()], [depth + len(w) for w in windows])
+    baseline = {q: residual(ranking, w, depth) for q, ranking, w in zip(queries, initial, windows)}
+    systems = {'baseline': baseline, **{i: run for i, run in enumerate(runs)}}
+    report = summary(evaluate(systems, relevants, depth, queries=queries))
+
+    results = [{'config': None, **report['baseline']}]
+    results += [{'config': configs[i], **report[i]} for i in range(len(configs))]
+    results.sort(key=lambda r: -r['map'])
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweeps the Rocchio parameters against the judgments.')
+    parser.add_argument('--alpha', type=float, nargs='+', default=GRID['alpha'])
+    parser.add_argument('--beta', type=float, nargs='+', default=GRID['beta'])
+    parser.add_argument('--gamma', type=float, nargs='+', default=GRID['gamma'])
+    parser.add_argument('--max-terms', type=int, nargs='+', default=None, help='0 means no truncation')
+    parser.add_argument('--random', type=int, default=None, help='random search with this many configurations')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=DEPTH)
+    parser.add_argument('--window', type=int, default=FEEDBACK_WINDOW, help='judged documents of the initial ranking')
+    parser.add_argument('--workers', type=int, default=None, help='processes, all the cores by default')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('-o', '--output', default=None)
+    args = parser.parse_args()
+
+    max_terms = GRID['max_terms'] if args.max_terms is None else [m or None for m in args.max_terms]
+    if args.random:
+        configs = random_search(args.random, args.seed, max_terms)
+    else:
+        configs = grid({'alpha': args.alpha, 'beta': args.beta, 'gamma': args.gamma, 'max_terms': max_terms})
+
+    results = sweep(configs, depth=args.depth, window=args.window, workers=args.workers)
+
+    for r in results[:args.top]:
+        metrics = '  '.join(f'{k} {v:.4f}' for k, v in r.items() if k != 'config')
+        print(f"{json.dumps(r['config']):<70} {metrics}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,225 @@
+"""
+    **ASGI** serving mode of `server.py`, e.g. `uvicorn asgi:app`.
+
+    `/score` and `/rf_score` requests arriving within `BATCH_WINDOW` seconds are
+    collected in a batch (at most `MAX_BATCH` requests) and scored together with a
+    single sparse product on the scoring thread, while the event loop keeps serving.
+    Every other endpoint is served by the Flask app of `server.py` on a thread pool.
+"""
+import io
+import sys
+import json
+import time
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+import feedback
+import metrics
+import server
+
+# CONSTANTS
+BATCH_WINDOW = .002
+MAX_BATCH = 64
+WSGI_THREADS = 8
+
+SCORING_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scoring')
+WSGI_EXECUTOR = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+class MicroBatcher:
+    """
+        Collects the items submitted within `window` seconds (at most `max_batch`)
+        and runs `fn(items) -> results` once on `executor` for all of them.
+    """
+
+    def __init__(self, fn, window : float = BATCH_WINDOW, max_batch : int = MAX_BATCH, executor = SCORING_EXECUTOR):
+        self.fn = fn
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = executor
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch : list) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.fn, [item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # one bad item must not fail the others: each one is run again on its own
+            for item_future in batch:
+                await self._run([item_future])
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# A batch is scored on one generation of the index (see `holder.IndexHolder.use`)
+def score_batch(items : list[tuple]) -> list[dict]:
+    with server.HOLDER.use() as idx:
+        return idx.score_batch([query for query, _ in items], [k for _, k in items])
+
+def rf_score_batch(items : list[dict]) -> list[dict]:
+    with server.HOLDER.use() as idx:
+        return feedback.rf_score_batch(idx, items, server.QUERY_CACHE)
+
+def ann_score_batch(items : list[tuple]) -> list[dict]:
+    with server.HOLDER.use() as idx:
+        return [idx.score(query, k, **ann) for query, k, ann in items]
+
+SCORE_BATCHER = MicroBatcher(score_batch)
+RF_SCORE_BATCHER = MicroBatcher(rf_score_batch)
+ANN_SCORER = MicroBatcher(ann_score_batch)
+
+
+#### APIs
+
+async def score(data : dict) -> dict:
+    r = server.score_request(data)
+    query, k = r['query'], r['k']
+    ann = {'candidates' : r['candidates'], 'rerank' : r['rerank']}
+    if ann['candidates']:
+        return await cached(server.score_key(query, k, 'csr', **ann), ANN_SCORER, (query, k, ann))
+    return await cached(server.score_key(query, k, 'csr'), SCORE_BATCHER, (query, k))
+
+async def rf_score(data : dict) -> dict:
+    r = server.rf_score_request(data)
+    return await cached(server.rf_score_key(r, 'csr'), RF_SCORE_BATCHER, r)
+
+async def cached(key : tuple, batcher : MicroBatcher, item) -> dict:
+    version = server.INDEX.version
+    if (result := server.RESULT_CACHE.get(key, version)) is None:
+        result = await batcher.submit(item)
+        server.RESULT_CACHE.put(key, result, version)
+    return result
+
+BATCHED = {
+    '/score' : score,
+    '/rf_score' : rf_score,
+}
+
+async def app(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type' : 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type' : 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            break
+
+    headers = {k.decode('latin1').lower() : v.decode('latin1') for k, v in scope['headers']}
+    if scope['method'] == 'POST' and (handler := BATCHED.get(scope['path'])):
+        start = time.perf_counter()
+        status, response_headers, payload = await batched(handler, headers, body)
+        metrics.count('requests_total', endpoint=scope['path'], status=str(status))
+        metrics.observe('request_seconds', time.perf_counter() - start, endpoint=scope['path'])
+    else:
+        loop = asyncio.get_running_loop()
+        status, response_headers, payload = await loop.run_in_executor(WSGI_EXECUTOR, wsgi, scope, headers, body)
+
+    await send({'type' : 'http.response.start', 'status' : status, 'headers' : response_headers})
+    await send({'type' : 'http.response.body', 'body' : payload})
+
+async def batched(handler, headers : dict, body : bytes) -> tuple:
+    """
+        Runs a batched endpoint, with the same checks of the Flask one.
+    """
+    if headers.get('content-type') != 'application/json':
+        return error(400)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return error(400)
+    if not data or not isinstance(data, dict):
+        return error(400)
+    if server.INDEX is None:
+        return error(503)
+    try:
+        result = await handler(data)
+    except (ValueError, TypeError, AttributeError):
+        return error(400)
+
+    payload = json.dumps(result).encode('utf8')
+    return 200, [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())], payload
+
+def error(status : int) -> tuple:
+    return status, [(b'content-type', b'text/plain')], str(status).encode()
+
+def wsgi(scope : dict, headers : dict, body : bytes) -> tuple:
+    """
+        Serves an ASGI http request with the Flask app of `server.py`.
+    """
+    environ = {
+        'REQUEST_METHOD' : scope['method'],
+        'SCRIPT_NAME' : scope.get('root_path', ''),
+        'PATH_INFO' : scope['path'],
+        'QUERY_STRING' : scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME' : (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT' : str((scope.get('server') or ('localhost', 80))[1]),
+        'SERVER_PROTOCOL' : f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH' : str(len(body)),
+        'wsgi.version' : (1, 0),
+        'wsgi.url_scheme' : scope.get('scheme', 'http'),
+        'wsgi.input' : io.BytesIO(body),
+        'wsgi.errors' : sys.stderr,
+        'wsgi.multithread' : True,
+        'wsgi.multiprocess' : False,
+        'wsgi.run_once' : False,
+    }
+    for k, v in headers.items():
+        if k == 'content-type':
+            environ['CONTENT_TYPE'] = v
+        elif k != 'content-length':
+            environ['HTTP_' + k.upper().replace('-', '_')] = v
+
+    started = {}
+    def start_response(status, response_headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in response_headers]
+
+    chunks = server.app.wsgi_app(environ, start_response)
+    try:
+        payload = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return started['status'], started['headers'], payload
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='127.0.0.1', port=5000)
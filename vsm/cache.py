@@ -0,0 +1,163 @@
+import sys
+import time
+import threading
+
+from collections import OrderedDict
+
+import vsm
+import metrics
+
+class Cache:
+    """
+        **LRU** cache with an optional time to live (`ttl`, in seconds) and a memory budget
+        (`max_bytes`, estimated with `sizeof` on keys & values). With `sliding` the ttl
+        is a time of inactivity: it restarts at each `get` of the entry.
+        Entries are bound to a `version` (e.g. `index.Index.version`): accessing the cache
+        with another version drops every entry.
+        `stats` returns hits, misses, evictions & memory counters.
+    """
+
+    def __init__(self, max_bytes : int, ttl : float | None = None, sliding : bool = False):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sliding = sliding
+        self.version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()     # key -> (value, size, expiry)
+        self._lock = threading.Lock()
+
+    def get(self, key, version = None, default = None):
+        """
+            The value of `key`, `default` if missing or expired.
+        """
+        with self._lock:
+            self._validate(version)
+            if (entry := self._entries.get(key)) is None:
+                self.misses += 1
+                return default
+            value, size, expiry = entry
+            if expiry is not None and expiry < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            if self.sliding and expiry is not None:
+                self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version = None) -> bool:
+        """
+            Stores `value`, evicting the least recently used entries to stay in budget.
+            Values larger than the whole budget are not stored: returns whether it was.
+        """
+        size = sizeof(key) + sizeof(value)
+        with self._lock:
+            self._validate(version)
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return False
+            while self.bytes + size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            expiry = None if self.ttl is None else time.monotonic() + self.ttl
+            self._entries[key] = (value, size, expiry)
+            self.bytes += size
+            return True
+
+    def delete(self, key) -> bool:
+        """
+            Removes `key`, returns whether it was stored.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._drop(key)
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries' : len(self._entries),
+                'bytes' : self.bytes,
+                'max_bytes' : self.max_bytes,
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions,
+                'expirations' : self.expirations,
+                'invalidations' : self.invalidations,
+            }
+
+    def _validate(self, version) -> None:
+        if version is not None and version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def _drop(self, key) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+
+def sizeof(obj) -> int:
+    """
+        Rough size in bytes of `obj`, containers included.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(x) for x in obj)
+    return size
+
+def normalise(text : str) -> str:
+    """
+        Cache key of a query text: the text `vsm.tokenize` splits (see `vsm.normalise`) with
+        its whitespaces collapsed, texts with the same key have the same tokens.
+    """
+    return ' '.join(vsm.normalise(text).split())
+
+def vector_key(query : dict) -> tuple:
+    """
+        Hashable key of a **sparse** vector.
+    """
+    return tuple(sorted(query.items()))
+
+def query_vector(index, text : str, cache : Cache | None = None) -> dict:
+    """
+        `vsm.query2vec` of `text` against `index`, through `cache` if given.
+        The returned vector is shared with the cache: do not modify it.
+    """
+    with metrics.stage('vectorize'):
+        if cache is None:
+            return vsm.query2vec(text, index.df, index.collection_size)
+
+        key = normalise(text)
+        if (vec := cache.get(key, index.version)) is None:
+            vec = vsm.query2vec(text, index.df, index.collection_size)
+            cache.put(key, vec, index.version)
+        return vec
+
+def query_vectors(index, texts : list[str], cache : Cache | None = None) -> list[dict]:
+    """
+        `query_vector` of each of `texts`, every distinct (normalised) text is vectorized once.
+    """
+    vectors = {}
+    for text in texts:
+        if (key := normalise(text)) not in vectors:
+            vectors[key] = query_vector(index, text, cache)
+    return [vectors[normalise(text)] for text in texts]
@@ -0,0 +1,240 @@
+"""
+    **Compressed** postings of a `csr.CSRModel`.
+
+    The postings of each term are sorted by document (row of `model.doc_ids`) and
+    stored as **varint** (LEB128) coded gaps in one byte array, with their L2-normalised
+    weights quantised to 8 or 16-bit **impacts**: a weight is `impact * scales[term]`,
+    where `scales[term]` is the largest weight of the term over `2^bits - 1`.
+    Every array is flat & contiguous, the float matrix is not kept.
+
+        python compressed.py        # bytes per posting & ranking fidelity report
+"""
+import time
+import numpy as np
+
+import csr
+import cache
+
+# CONSTANTS
+BITS = 8
+IMPACT_TYPES = {8 : np.uint8, 16 : np.uint16}
+
+class CompressedPostings:
+    """
+        Term-major postings of `model` (`bits` per impact, 8 or 16):
+            - `vocabulary`: {`term`->`column`}, as `model.vocabulary`.
+            - `doc_ids`: the docID of each row, as `model.doc_ids`.
+            - `gaps`: uint8, the varint coded row gaps of every term, one after the other.
+            - `gap_offsets`: the gaps of term `t` are `gaps[gap_offsets[t]:gap_offsets[t + 1]]`.
+            - `impacts`: the quantised weights, `impacts[offsets[t]:offsets[t + 1]]` for term `t`.
+            - `scales`: float32, the weight of one impact unit of each term.
+    """
+
+    def __init__(self, model : csr.CSRModel, bits : int = BITS):
+        if bits not in IMPACT_TYPES:
+            raise ValueError(f'impacts of {bits} bits are not supported')
+        self.bits = bits
+        self.vocabulary = dict(model.vocabulary)
+        self.doc_ids = model.doc_ids.copy()
+
+        M = model.matrix_t      # term-major, rows sorted in each term
+        self.offsets = M.indptr.astype(np.int64)
+        rows = M.indices.astype(np.int64)
+        first = np.zeros(len(rows), dtype=bool)
+        first[self.offsets[:-1][np.diff(self.offsets) > 0]] = True
+        gaps = np.where(first, rows, rows - np.concatenate([[0], rows[:-1]]))
+
+        self.gaps, lengths = encode_varint(gaps)
+        self.gap_offsets = np.concatenate([[0], np.cumsum(lengths)])[self.offsets]
+        self.scales, self.impacts = quantise(M.data, self.offsets, bits)
+
+    @classmethod
+    def from_arrays(
+            cls,
+            doc_ids : np.ndarray,
+            vocabulary : dict,
+            offsets : np.ndarray,
+            gaps : np.ndarray,
+            gap_offsets : np.ndarray,
+            impacts : np.ndarray,
+            scales : np.ndarray
+        ) -> 'CompressedPostings':
+        """
+            Postings over existing arrays, e.g. the memory mapped ones of a `snapshot.Snapshot`,
+            used as they are: no float matrix is needed.
+        """
+        postings = cls.__new__(cls)
+        postings.bits = impacts.dtype.itemsize * 8
+        postings.vocabulary = vocabulary
+        postings.doc_ids = doc_ids
+        postings.offsets = offsets
+        postings.gaps = gaps
+        postings.gap_offsets = gap_offsets
+        postings.impacts = impacts
+        postings.scales = scales
+        return postings
+
+    @property
+    def n_postings(self) -> int:
+        return len(self.impacts)
+
+    @property
+    def nbytes(self) -> int:
+        """
+            Bytes of every array (vocabulary excluded).
+        """
+        arrays = (self.doc_ids, self.gaps, self.gap_offsets, self.offsets, self.impacts, self.scales)
+        return sum(a.nbytes for a in arrays)
+
+    def postings(self, col : int) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Rows and (dequantised) weights of the postings of the term in column `col`.
+        """
+        rows = np.cumsum(decode_varint(self.gaps[self.gap_offsets[col]:self.gap_offsets[col + 1]]))
+        impacts = self.impacts[self.offsets[col]:self.offsets[col + 1]]
+        return rows, impacts * self.scales[col]
+
+    def score(self, query : dict) -> np.ndarray:
+        """
+            Dense array with the (approximate) cosine similarity between `query` and each
+            document of `doc_ids`, as `csr.CSRModel.score`.
+        """
+        scores = np.zeros(len(self.doc_ids), dtype=np.float64)
+        norm = float(np.linalg.norm(list(query.values()))) if query else 0.
+        if norm == 0:
+            return scores
+        for t, w in query.items():
+            if (col := self.vocabulary.get(t)) is not None:
+                rows, weights = self.postings(col)
+                scores[rows] += (w / norm) * weights
+        return scores
+
+    def rank(self, scores : np.ndarray, k : int = -1) -> dict:
+        return csr.rank(self.doc_ids, scores, k)
+
+def encode_varint(values : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+        LEB128 coding of the non negative `values`: 7 bits per byte, the high bit set on
+        every byte but the last one of a value. Returns the bytes and the length of each value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = varint_lengths(values)
+
+    owner = np.repeat(np.arange(len(values)), lengths)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    payload = (values[owner] >> (7 * position).astype(np.uint64)) & np.uint64(0x7f)
+    more = (position < lengths[owner] - 1).astype(np.uint64) << np.uint64(7)
+    return (payload | more).astype(np.uint8), lengths
+
+def varint_lengths(values : np.ndarray) -> np.ndarray:
+    """
+        The number of bytes of each of the non negative `values` once LEB128 coded.
+    """
+    rest = np.asarray(values, dtype=np.uint64).copy()
+    bits = np.zeros(len(rest), dtype=np.int64)
+    while (nonzero := rest > 0).any():
+        bits += nonzero
+        rest >>= np.uint64(1)
+    return np.maximum(1, -(-bits // 7))
+
+def decode_varint(data : np.ndarray) -> np.ndarray:
+    """
+        The values of the LEB128 coded bytes `data`, see `encode_varint`.
+    """
+    if not len(data) or data.max() < 0x80:     # one byte per value
+        return data.astype(np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+def quantise(weights : np.ndarray, offsets : np.ndarray, bits : int = BITS) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Quantises the `weights` of each term (`weights[offsets[t]:offsets[t + 1]]`) to `bits` bits,
+        linearly up to the largest weight of the term. Returns the scale of each term and the impacts.
+    """
+    counts = np.diff(offsets)
+    maxima = np.zeros(len(counts), dtype=np.float64)
+    nonempty = counts > 0
+    maxima[nonempty] = np.maximum.reduceat(weights, offsets[:-1][nonempty])
+    scales = scales_of(maxima, bits)
+    return scales, quantise_impacts(weights, np.repeat(scales, counts), bits)
+
+def scales_of(maxima : np.ndarray, bits : int = BITS) -> np.ndarray:
+    """
+        The weight of one impact unit of terms with the largest weights `maxima`.
+    """
+    return (maxima / ((1 << bits) - 1)).astype(np.float32)
+
+def quantise_impacts(weights : np.ndarray, scales : np.ndarray, bits : int = BITS) -> np.ndarray:
+    """
+        The impacts of `weights`, each one with the scale (`scales_of`) of its term.
+    """
+    unit = scales.astype(np.float64)
+    impacts = np.rint(np.divide(weights, unit, out=np.zeros(len(weights)), where=unit > 0))
+    return np.clip(impacts, 0, (1 << bits) - 1).astype(IMPACT_TYPES[bits])
+
+def report(idx, queries : list[dict], k : int = 10, bits : tuple = (8, 16)) -> dict:
+    """
+        Bytes per posting of the compressed postings (for each of `bits`) against the CSR
+        matrix and the `tf_idf` dicts of `idx`, and the ranking fidelity of their top `k`
+        against the float weights: overlap of the top k, exact top k order and largest score error.
+    """
+    model = idx.csr_model()
+    n = model.matrix.nnz
+    exact = [model.score(q) for q in queries]
+    exact_top = [list(model.rank(s, k)) for s in exact]
+
+    with idx.lock:
+        dicts = cache.sizeof(idx.tf_idf)
+    result = {
+        'documents' : len(model.doc_ids),
+        'postings' : n,
+        'tf_idf_dicts_bytes_per_posting' : dicts / n,
+        'csr_bytes_per_posting' : (model.matrix_t.data.nbytes + model.matrix_t.indices.nbytes) / n,
+    }
+
+    for b in bits:
+        start = time.perf_counter()
+        postings = CompressedPostings(model, b)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores = [postings.score(q) for q in queries]
+        latency = (time.perf_counter() - start) / len(queries)
+        top = [list(postings.rank(s, k)) for s in scores]
+
+        result[f'{b}bit'] = {
+            'bytes_per_posting' : (postings.gaps.nbytes + postings.impacts.nbytes) / n,
+            'total_bytes_per_posting' : postings.nbytes / n,
+            f'overlap@{k}' : float(np.mean([len(set(t) & set(e)) / len(e) for t, e in zip(top, exact_top) if e])),
+            f'same_top{k}' : float(np.mean([t == e for t, e in zip(top, exact_top)])),
+            'max_score_error' : float(max(np.abs(s - e).max() for s, e in zip(scores, exact))),
+            'build_s' : build,
+            'score_ms' : latency * 1e3,
+        }
+    return result
+
+
+if __name__ == '__main__':
+    import json
+    import random
+    import argparse
+
+    import index
+    import snapshot
+
+    parser = argparse.ArgumentParser(description='Size & ranking fidelity of the compressed postings.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    idx = index.Index.from_snapshot(snapshot.load_or_build(log=True))
+    # Queries of a few terms of random documents, weighted as in their document
+    rng = random.Random(0)
+    queries = []
+    for d in rng.sample([d for d, vec in idx.tf_idf.items() if vec], args.queries):
+        terms = rng.sample(list(idx.tf_idf[d]), min(5, len(idx.tf_idf[d])))
+        queries.append({t : idx.tf_idf[d][t] for t in terms})
+
+    print(json.dumps(report(idx, queries, args.k), indent=2))
@@ -0,0 +1,120 @@
+import numpy as np
+from scipy import sparse
+
+class CSRModel:
+    """
+        **Sparse matrix** (CSR) backend of the vector space model.
+        The rows of `matrix` are the **L2-normalised** tf-idf vectors of the documents,
+        the columns are indexed by `vocabulary` {`term`->`column`}.
+    """
+
+    def __init__(self, TF_IDF : dict, dtype = np.float64):
+        self.doc_ids = np.array([doc_id for doc_id in sorted(TF_IDF) if TF_IDF[doc_id]], dtype=np.int64)
+        self.vocabulary = {}
+
+        indptr = [0]
+        indices = []
+        values = []
+        for doc_id in self.doc_ids:
+            for term, w in TF_IDF[int(doc_id)].items():
+                indices.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                values.append(w)
+            indptr.append(len(indices))
+
+        values = np.array(values, dtype=np.float64)
+        indptr = np.array(indptr, dtype=np.int64)
+        norms = np.sqrt(np.add.reduceat(values ** 2, indptr[:-1])) if len(values) else values
+        values /= np.repeat(np.where(norms > 0, norms, 1), np.diff(indptr))
+
+        self.matrix = sparse.csr_matrix(
+            (values.astype(dtype), np.array(indices, dtype=np.int32), indptr),
+            shape=(len(self.doc_ids), len(self.vocabulary))
+        )
+        # term-major copy: a query only visits the rows of its own terms
+        self.matrix_t = self.matrix.T.tocsr()
+
+    @classmethod
+    def from_arrays(cls, doc_ids : np.ndarray, vocabulary : dict, rows : tuple, columns : tuple) -> 'CSRModel':
+        """
+            Model over existing **L2-normalised** arrays, e.g. the memory mapped ones of a
+            `snapshot.Snapshot`: `rows` and `columns` are the (`data`, `indices`, `indptr`)
+            of `matrix` and `matrix_t`, used as they are (nothing is copied).
+        """
+        model = cls.__new__(cls)
+        model.doc_ids = doc_ids
+        model.vocabulary = vocabulary
+        model.matrix = sparse.csr_matrix(rows, shape=(len(doc_ids), len(vocabulary)), copy=False)
+        model.matrix_t = sparse.csr_matrix(columns, shape=(len(vocabulary), len(doc_ids)), copy=False)
+        return model
+
+    def query_matrix(self, queries : list[dict]) -> sparse.csr_matrix:
+        """
+            Turns a list of **sparse** query vectors into a (`len(queries)` x V) CSR matrix.
+            Each row is divided by the norm of the **whole** query (terms out of the vocabulary included),
+            so that a dot product with a document row is their cosine similarity.
+        """
+        indptr = [0]
+        indices = []
+        values = []
+        for query in queries:
+            norm = float(np.linalg.norm(list(query.values()))) if query else 0.
+            if norm != 0:
+                for t, w in query.items():
+                    if (col := self.vocabulary.get(t)) is not None:
+                        indices.append(col)
+                        values.append(w / norm)
+            indptr.append(len(indices))
+
+        return sparse.csr_matrix(
+            (np.array(values, dtype=self.matrix.dtype), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(queries), len(self.vocabulary))
+        )
+
+    def score_batch(self, queries : list[dict]) -> sparse.csr_matrix:
+        """
+            Cosine similarity of many queries with a **single** sparse mat-mat product.
+            Returns a (`len(queries)` x N) CSR matrix, the columns follow `doc_ids`.
+        """
+        return self.query_matrix(queries) @ self.matrix_t
+
+    def score(self, query : dict) -> np.ndarray:
+        """
+            Dense array with the cosine similarity between `query` and each document of `doc_ids`.
+        """
+        return self.score_batch([query]).toarray()[0]
+
+    def rank(self, scores : np.ndarray, k : int = -1) -> dict:
+        """
+            Maps a dense score array into a {`docID`->`score`} map, see `rank`.
+        """
+        return rank(self.doc_ids, scores, k)
+
+    def rank_batch(self, queries : list[dict], k : int = -1) -> list[dict]:
+        """
+            Scores & ranks many queries at once, see `score_batch` and `rank`.
+        """
+        S = self.score_batch(queries)
+        return [self.rank(S[i].toarray()[0], k) for i in range(S.shape[0])]
+
+
+def rank(doc_ids : np.ndarray, scores : np.ndarray, k : int = -1) -> dict:
+    """
+        Maps a dense score array, aligned with `doc_ids`, into a {`docID`->`score`} map.
+        If `k` is -1 every document is returned in docID order, otherwise only the **top k**
+        sorted by decreasing score (ties broken by docID, like a stable sort of the whole map).
+    """
+    return {int(doc_ids[i]) : float(scores[i]) for i in top_order(doc_ids, scores, k)}
+
+def top_order(doc_ids : np.ndarray, scores : np.ndarray, k : int = -1) -> np.ndarray:
+    """
+        The positions of the **top k** of `scores` (all of them in order if -1), see `rank`.
+    """
+    if k == -1:
+        return np.arange(len(scores))
+    if k == 0:
+        return np.arange(0)
+    if k < 0 or k >= len(scores):
+        return np.lexsort((doc_ids, -scores))[:k]
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    cand = np.flatnonzero(scores >= kth)
+    return cand[np.lexsort((doc_ids[cand], -scores[cand]))][:k]
@@ -0,0 +1,182 @@
+import heapq
+import numpy as np
+import vsm
+import cache
+import vector
+import metrics
+
+# CONSTANTS
+ALPHA = .3
+BETA = .3
+GAMMA = .3
+
+def rocchio(
+        query : dict,
+        relevants : list[dict] = [],
+        non_relevants : list[dict] = [],
+        alpha : float = ALPHA,
+        beta : float = BETA,
+        gamma : float = GAMMA,
+        max_terms : int | None = None,
+        drop_negative : bool = False
+    ) -> dict:
+    """
+        New query vector computed with [Rocchio's algorithm](https://en.wikipedia.org/wiki/Rocchio_algorithm).
+        Both centroids are accumulated in a single pass over the feedback vectors.
+        The expanded query can be truncated:
+            - `drop_negative`: removes the terms with weight <= 0.
+            - `max_terms`: keeps only the `max_terms` heaviest terms.
+    """
+    q = {t : w * alpha for t, w in query.items()}
+
+    for vectors, coeff in ((relevants, beta), (non_relevants, -gamma)):
+        if not vectors:
+            continue
+        centroid = {}
+        for v in vectors:
+            for t, w in v.items():
+                centroid[t] = centroid.get(t, 0) + w
+        scale = 1 / len(vectors)
+        for t, w in centroid.items():
+            q[t] = q.get(t, 0) + w * scale * coeff
+
+    return truncate(q, max_terms, drop_negative)
+
+def sparse_rocchio(
+        index,
+        query : dict,
+        relevants : list[int] = [],
+        non_relevants : list[int] = [],
+        alpha : float = ALPHA,
+        beta : float = BETA,
+        gamma : float = GAMMA,
+        max_terms : int | None = None,
+        drop_negative : bool = False
+    ) -> dict:
+    """
+        `rocchio` with the documents `relevants` and `non_relevants` of `index`, read as term ids
+        of `index.vocabulary` (see `index.Index.entries`): the query and both centroids are summed
+        in a **single** `vector.merge` of their id arrays.
+        `query` and the returned vector are {`term`->`weight`} maps, the query terms
+        out of the vocabulary are kept with their weight scaled by `alpha`.
+    """
+    with index.lock:
+        ids, weights = [], []
+        # the documents first: an index without snapshot gives ids to their terms on the way
+        for docs, coeff in ((relevants, beta), (non_relevants, -gamma)):
+            terms, w, n = index.entries(docs)
+            if n:
+                ids.append(terms)
+                weights.append(w * (coeff / n))
+        vocabulary = index.vocabulary
+        known = vector.SparseVector.from_dict(query, vocabulary)
+        q = vector.merge(np.concatenate([known.ids] + ids), np.concatenate([known.weights * alpha] + weights)).to_dict(vocabulary)
+        if len(known) < len(query):
+            q.update((t, w * alpha) for t, w in query.items() if t not in vocabulary.ids)
+    return truncate(q, max_terms, drop_negative)
+
+def truncate(query : dict, max_terms : int | None = None, drop_negative : bool = False) -> dict:
+    """
+        Keeps the `max_terms` heaviest terms of `query` (all if `None`),
+        without the ones with weight <= 0 if `drop_negative`.
+    """
+    if drop_negative:
+        query = {t : w for t, w in query.items() if w > 0}
+    if max_terms is not None and len(query) > max_terms:
+        query = dict(heapq.nlargest(max_terms, query.items(), key=lambda x: x[1]))
+    return query
+
+def get_vectors(index, ids : list[int]) -> dict:
+    """
+        Given a list of **docID**s returns their **sparse** vector representation
+        {`docID`->{`term`->`tf-idf`}}, unknown and empty documents are skipped.
+    """
+    result = {}
+    with index.lock:
+        for id in ids:
+            if (vec := index.document(id)):
+                result[id] = vec
+    return result
+
+def feedback_query(
+        index,
+        query : dict,
+        relevants : list[int] = [],
+        non_relevants : list[int] = [],
+        **params
+    ) -> dict:
+    """
+        Rocchio expansion of the **sparse** `query` with the documents `relevants` and `non_relevants`:
+        `sparse_rocchio` on a mapped index, `rocchio` otherwise. `params` are passed to it.
+    """
+    metrics.count('feedback_documents_total', len(relevants), kind='relevant')
+    metrics.count('feedback_documents_total', len(non_relevants), kind='non_relevant')
+    with metrics.stage('rocchio'):
+        if index.mapped:
+            return sparse_rocchio(index, query, relevants, non_relevants, **params)
+        # the maps of an index without snapshot already are {`term`->`weight`} vectors
+        relevant_vec = list(get_vectors(index, relevants).values())
+        non_relevant_vec = list(get_vectors(index, non_relevants).values())
+        return rocchio(query, relevant_vec, non_relevant_vec, **params)
+
+def rf_score(
+        index,
+        fields : dict,
+        relevants : list[int] = [],
+        non_relevants : list[int] = [],
+        k : int = -1,
+        backend : str = 'postings',
+        query_cache : cache.Cache | None = None,
+        candidates : int | None = None,
+        rerank : bool = True,
+        **params
+    ) -> dict:
+    """
+        Relevance feedback pipeline, in process:
+            1. vectorizes the user query `fields` (title & overview), through `query_cache` if given.
+            2. expands it with Rocchio's algorithm.
+            3. scores it against `index` and keeps the **top k** (all if -1), only among
+               `candidates` approximate neighbours if given (see `index.Index.score`).
+        Returns the {`docID`->`score`} map of `index.score`.
+    """
+    query_str = fields.get(vsm.TITLE, '') + fields.get(vsm.OVERVIEW, '')
+    query_vec = cache.query_vector(index, query_str, query_cache)
+    new_query = feedback_query(index, query_vec, relevants, non_relevants, **params)
+    return index.score(new_query, k, backend, candidates, rerank)
+
+def rf_score_batch(index, requests : list[dict], query_cache : cache.Cache | None = None) -> list[dict]:
+    """
+        `rf_score` of many requests, scored together with `index.score_batch`.
+        Each request is a dict of `rf_score` keyword arguments:
+        `fields`, `relevants`, `non_relevants`, `k`, `candidates`, `rerank` and the `rocchio` parameters.
+        The query texts are vectorized once each (see `cache.query_vectors`),
+        requests with `candidates` are scored one by one on the ANN index.
+    """
+    results = [None] * len(requests)
+    texts = [
+        r.get('fields', {}).get(vsm.TITLE, '') + r.get('fields', {}).get(vsm.OVERVIEW, '')
+        for r in requests
+    ]
+    queries = []
+    ks = []
+    exact = []
+    for i, (r, query_vec) in enumerate(zip(requests, cache.query_vectors(index, texts, query_cache))):
+        params = dict(r)
+        params.pop('fields', None)
+        relevants = params.pop('relevants', [])
+        non_relevants = params.pop('non_relevants', [])
+        k = params.pop('k', -1)
+        candidates = params.pop('candidates', None)
+        rerank = params.pop('rerank', True)
+
+        query = feedback_query(index, query_vec, relevants, non_relevants, **params)
+        if candidates:
+            results[i] = index.score(query, k, candidates=candidates, rerank=rerank)
+        else:
+            queries.append(query)
+            ks.append(k)
+            exact.append(i)
+
+    for i, result in zip(exact, index.score_batch(queries, ks) if queries else []):
+        results[i] = result
+    return results
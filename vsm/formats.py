@@ -0,0 +1,73 @@
+import json
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:     # optional, MSGPACK is not offered without it
+    msgpack = None
+
+# CONSTANTS
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+BINARY = 'application/octet-stream'
+NDJSON = 'application/x-ndjson'
+NDJSON_CHUNK = 1024
+
+def available(binary : bool = True) -> list[str]:
+    """
+        The response formats, in order of preference (JSON stays the default).
+        `binary` is `False` for responses that are not a score map.
+    """
+    return [JSON] + ([MSGPACK] if msgpack else []) + ([BINARY] if binary else []) + [NDJSON]
+
+# BINARY
+def encode_scores(scores : dict) -> bytes:
+    """
+        Little-endian encoding of a {`docID`->`score`} map:
+            - `n`: uint32, the number of entries.
+            - `n` int32 docIDs.
+            - `n` float64 scores.
+    """
+    ids = np.fromiter(scores.keys(), dtype='<i4', count=len(scores))
+    values = np.fromiter(scores.values(), dtype='<f8', count=len(scores))
+    return np.array([len(scores)], dtype='<u4').tobytes() + ids.tobytes() + values.tobytes()
+
+def decode_scores(data : bytes) -> dict:
+    """
+        Inverse of `encode_scores`.
+    """
+    n = int(np.frombuffer(data, dtype='<u4', count=1)[0])
+    ids = np.frombuffer(data, dtype='<i4', count=n, offset=4)
+    values = np.frombuffer(data, dtype='<f8', count=n, offset=4 + 4 * n)
+    return dict(zip(ids.tolist(), values.tolist()))
+
+# MSGPACK
+def encode_msgpack(obj : dict) -> bytes:
+    """
+        MessagePack encoding of `obj`, integer keys (docIDs) are kept as integers:
+        decode it with `msgpack.unpackb(data, strict_map_key=False)`.
+    """
+    return msgpack.packb(obj)
+
+# NDJSON
+def ndjson_scores(scores : dict, chunk : int = NDJSON_CHUNK):
+    """
+        Yields a {`docID`->`score`} map as `{"docID": .., "score": ..}` lines, `chunk` lines at a time.
+    """
+    items = iter(scores.items())
+    while (lines := [
+        f'{{"docID": {doc_id}, "score": {json.dumps(float(score))}}}\n'
+        for _, (doc_id, score) in zip(range(chunk), items)
+    ]):
+        yield ''.join(lines)
+
+def ndjson_vectors(vectors : dict, chunk : int = NDJSON_CHUNK):
+    """
+        Yields a {`docID`->{`term`->`tf-idf`}} map as `{"docID": .., "vector": {..}}` lines, `chunk` lines at a time.
+    """
+    items = iter(vectors.items())
+    while (lines := [
+        json.dumps({'docID' : doc_id, 'vector' : vec}) + '\n'
+        for _, (doc_id, vec) in zip(range(chunk), items)
+    ]):
+        yield ''.join(lines)
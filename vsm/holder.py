@@ -0,0 +1,171 @@
+"""
+    **Generations** of the served index.
+
+    `IndexHolder.rebuild` builds the snapshot of the (updated) collection in a background
+    thread and swaps its `index.Index` in atomically when it is complete: a request takes
+    its generation once with `acquire` and finishes on it, the next ones get the new
+    generation. The old one is closed when its last request calls `release`.
+    Changes made to the old generation during a rebuild (e.g. `/documents`) are not carried over.
+"""
+import time
+import threading
+
+from contextlib import contextmanager
+
+import vsm
+import index
+import shards
+import snapshot
+
+class IndexHolder:
+    """
+        The current `index` and its `generation` (1 for the first one, `index` is `None`
+        and `generation` 0 until it is loaded, see `load`).
+        `rebuild` reads `source` (default `vsm.JSON_FILE`) and writes its snapshot in `path`,
+        every generation scores the 'sharded' backend on `n_shards` processes.
+        `on_swap(index)` is called after each swap. `progress` describes the last rebuild.
+    """
+
+    def __init__(
+            self,
+            idx : index.Index | None = None,
+            source : str | None = None,
+            path : str = snapshot.SNAPSHOT_FILE,
+            workers : int | None = 1,
+            n_shards : int = shards.SHARDS,
+            on_swap = None
+        ):
+        self.index = None
+        self.generation = 0
+        self.source = source
+        self.path = path
+        self.workers = workers
+        self.n_shards = n_shards
+        self.on_swap = on_swap
+        self.progress = {'state' : 'idle'}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._requests = {}         # in-flight requests of each generation
+        if idx is not None:
+            self.swap(idx)
+
+    @property
+    def building(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def load(self, log : bool = False) -> bool:
+        """
+            Serves the snapshot in `path` if it was built from the current `source`,
+            otherwise starts a `rebuild`. Returns `True` if the snapshot was loaded.
+        """
+        if (snap := snapshot.load(self.path, self.source)) is not None:
+            if log:
+                print(f'{vsm.GREEN}[LOAD]{vsm.END}\tSnapshot {self.path} loaded.')
+            self.swap(index.Index.from_snapshot(snap))
+            return True
+
+        if log:
+            print(f'{vsm.PURPLE}[WARNING]{vsm.END}\tSnapshot {self.path} missing or outdated, rebuilding in background.')
+        self.rebuild()
+        return False
+
+    def rebuild(self) -> bool:
+        """
+            Starts rebuilding the index in a background thread,
+            returns `False` if a rebuild is already running.
+        """
+        with self._lock:
+            if self.building:
+                return False
+            self.progress = {'state' : 'processing', 'documents' : 0, 'started' : time.time()}
+            self._thread = threading.Thread(target=self._build, name='index-rebuild', daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout : float | None = None) -> bool:
+        """
+            Waits for the running rebuild, returns `False` on timeout.
+        """
+        if (thread := self._thread) is not None:
+            thread.join(timeout)
+        return not self.building
+
+    def _build(self) -> None:
+        start = time.perf_counter()
+        source = self.source or vsm.JSON_FILE
+        try:
+            if (snap := snapshot.build(self.path, source, workers=self.workers, progress=self._update)) is None:
+                raise RuntimeError(f'{source} changed during the build')
+            self.swap(index.Index.from_snapshot(snap))
+            self._update(state='done', seconds=time.perf_counter() - start, generation=self.generation)
+        except Exception as e:
+            self._update(state='failed', error=f'{type(e).__name__}: {e}', seconds=time.perf_counter() - start)
+
+    def _update(self, **changes) -> None:
+        self.progress = {**self.progress, **changes}
+
+    def swap(self, new : index.Index) -> None:
+        """
+            Makes `new` the current index, with the settings of the current one.
+            Its `version` is moved past the old one, so that every cache bound to
+            `index.Index.version` is refreshed. The old generation keeps its own
+            sharded workers until it is closed, once its in-flight requests are done.
+        """
+        with self._lock:
+            old = self.index
+            with new.lock:
+                new.n_shards = self.n_shards
+                if old is not None:
+                    with old.lock:
+                        new.refresh_every = old.refresh_every
+                        new.version += old.version + 1
+            self.index = new
+            self.generation += 1
+            drained = old is not None and old not in self._requests
+        if self.on_swap is not None:
+            self.on_swap(new)
+        if drained:
+            old.close()
+
+    def acquire(self) -> index.Index | None:
+        """
+            The current index (`None` if not loaded yet) for a request, which has to
+            `release` it when done: until then its generation is not closed.
+        """
+        with self._lock:
+            if (idx := self.index) is not None:
+                self._requests[idx] = self._requests.get(idx, 0) + 1
+            return idx
+
+    def release(self, idx : index.Index) -> None:
+        """
+            Ends a request on `idx`, closing it if it is the last one of a replaced generation.
+        """
+        with self._lock:
+            self._requests[idx] -= 1
+            if self._requests[idx]:
+                return
+            del self._requests[idx]
+            retired = idx is not self.index
+        if retired:
+            idx.close()
+
+    @contextmanager
+    def use(self):
+        """
+            `acquire` & `release` around a block: `with holder.use() as idx: ...`
+        """
+        idx = self.acquire()
+        try:
+            yield idx
+        finally:
+            if idx is not None:
+                self.release(idx)
+
+    def status(self) -> dict:
+        status = {'generation' : self.generation}
+        if (idx := self.index) is not None:
+            with idx.lock:
+                status.update(documents=idx.collection_size, version=idx.version, stale=idx.stale)
+        status.update(building=self.building, build=dict(self.progress))
+        return status
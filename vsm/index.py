@@ -0,0 +1,476 @@
+import sys
+import threading
+import numpy as np
+
+from bisect import bisect_left, insort
+from collections import Counter
+
+import vsm
+import csr
+import lsa
+import compressed
+import shards
+import vector
+import metrics
+
+# CONSTANTS
+REFRESH_EVERY = 100
+
+def term_frequencies(tokens : list[str]) -> dict:
+    """
+        The **tf** of each distinct term of `tokens`, as in `vsm.compute_tfidf`.
+        The structure of the map is {`term`->`tf`}, sorted by term.
+        Terms are interned: every document shares the same strings.
+    """
+    counter = Counter(map(sys.intern, tokens))
+    return {t : counter[t] / len(counter) for t in sorted(counter)}
+
+class Index:
+    """
+        **Mutable** inverted index of the collection.
+        It keeps, always up to date:
+            - `tf`: {`docID`->{`term`->`tf`}}.
+            - `df`: {`term`->`df`}.
+            - `collection_size`: the number of documents.
+        and the structures used for scoring:
+            - `tf_idf`: {`docID`->{`term`->`tf-idf`}}.
+            - `postings`: {`term`->[(`docID`, `tf-idf`), ...]} sorted by docID.
+            - `norms`: {`docID`->`norm`}.
+            - `max_weights`: {`term`->(`max(tf-idf / norm)`, `docID`)}.
+        `vocabulary` gives the term ids of `entries` (the ones of the snapshot if mapped).
+        An index of a `snapshot.Snapshot` is **mapped**: it scores on the CSR arrays of the
+        snapshot and every map but `df` is only built, once, when it is first needed
+        (e.g. by an update). `document` and `in` do not need them.
+
+        A new (or updated) document is weighted with the current idf, the weights of the
+        other documents are not touched: they are refreshed all together every
+        `refresh_every` changes (1 means at each change, `None` only calling `refresh`).
+        Until then `stale` is `True` and scores use the idf the weights were computed with.
+
+        Every access has to hold `lock`, `version` changes at each update of the index.
+    """
+
+    def __init__(self, refresh_every : int | None = REFRESH_EVERY):
+        self.refresh_every = refresh_every
+        self.lock = threading.RLock()
+        self.version = 0
+        self.pending = 0
+        self.snapshot = None
+        self.vocabulary = vector.Vocabulary()
+        self.df = {}
+        self._tf = {}
+        self._tf_idf = {}
+        self._postings = {}
+        self._norms = {}
+        self._max_weights = {}
+        self.n_shards = shards.SHARDS
+        self._csr = None
+        self._lsa = None
+        self._lsa_version = None
+        self._lsa_building = False
+        self._lsa_built = threading.Condition(self.lock)
+        self._compressed = None
+        self._sharded = None
+
+    @property
+    def collection_size(self) -> int:
+        if (snapshot := self.snapshot) is not None:
+            return snapshot.collection_size
+        return len(self._tf)
+
+    @property
+    def mapped(self) -> bool:
+        return self.snapshot is not None
+
+    @property
+    def tf(self) -> dict:
+        return self._maps()._tf
+
+    @property
+    def tf_idf(self) -> dict:
+        return self._maps()._tf_idf
+
+    @property
+    def postings(self) -> dict:
+        return self._maps()._postings
+
+    @property
+    def norms(self) -> dict:
+        return self._maps()._norms
+
+    @property
+    def max_weights(self) -> dict:
+        return self._maps()._max_weights
+
+    def _maps(self) -> 'Index':
+        """
+            Builds the maps of a mapped index from its snapshot (weights as they are), once.
+        """
+        if self.snapshot is None:
+            return self
+        with self.lock:
+            if (snapshot := self.snapshot) is not None:
+                self._tf = snapshot.tf()
+                self._tf_idf = snapshot.tf_idf()
+                self._norms = snapshot.norms()
+                self._postings = vsm.compute_postings(self._tf_idf)
+                self._max_weights = vsm.compute_max_weights(self._postings, self._norms)
+                self.snapshot = None
+        return self
+
+    def __contains__(self, doc_id : int) -> bool:
+        with self.lock:
+            if self.snapshot is not None:
+                return self._row(doc_id) is not None
+            return doc_id in self._tf
+
+    def document(self, doc_id : int) -> dict | None:
+        """
+            The {`term`->`tf-idf`} vector of `doc_id` (`None` if it is not indexed).
+        """
+        with self.lock:
+            if (snapshot := self.snapshot) is None:
+                return self._tf_idf.get(doc_id)
+            if (i := self._row(doc_id)) is None:
+                return None
+            lo, hi = snapshot.doc_indptr[i], snapshot.doc_indptr[i + 1]
+            terms = self.vocabulary.terms
+            return dict(zip([terms[j] for j in snapshot.doc_terms[lo:hi].tolist()], snapshot.doc_weights[lo:hi].tolist()))
+
+    def entries(self, doc_ids : list[int]) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+            The term ids (of `vocabulary`) and tf-idf weights of the (indexed, non empty) documents
+            `doc_ids`, one document after the other, and the number of these documents.
+            A mapped index reads them from its snapshot, without building any map.
+        """
+        doc_ids = dict.fromkeys(doc_ids)
+        with self.lock:
+            if (snapshot := self.snapshot) is None:
+                docs = [vec for doc_id in doc_ids if (vec := self._tf_idf.get(doc_id))]
+                ids = self.vocabulary.id
+                terms = np.fromiter((ids(t) for vec in docs for t in vec), dtype=np.int32)
+                weights = np.fromiter((w for vec in docs for w in vec.values()), dtype=np.float64, count=len(terms))
+                return terms, weights, len(docs)
+
+            indptr = snapshot.doc_indptr
+            slices = [
+                slice(lo, hi) for doc_id in doc_ids
+                if (i := self._row(doc_id)) is not None and (lo := int(indptr[i])) < (hi := int(indptr[i + 1]))
+            ]
+            if not slices:
+                return np.zeros(0, dtype=np.int32), np.zeros(0), 0
+            return np.concatenate([snapshot.doc_terms[s] for s in slices]), np.concatenate([snapshot.doc_weights[s] for s in slices]), len(slices)
+
+    def _row(self, doc_id : int) -> int | None:
+        doc_ids = self.snapshot.doc_ids         # sorted by docID
+        i = int(np.searchsorted(doc_ids, doc_id))
+        return i if i < len(doc_ids) and doc_ids[i] == doc_id else None
+
+    @property
+    def stale(self) -> bool:
+        return self.pending > 0
+
+    @classmethod
+    def from_data(cls, data : list[dict], refresh_every : int | None = REFRESH_EVERY) -> 'Index':
+        """
+            Index of a **processed** collection, see `vsm.load_processed_data`.
+        """
+        return cls.from_batches([data], refresh_every)
+
+    @classmethod
+    def from_batches(cls, batches, refresh_every : int | None = REFRESH_EVERY) -> 'Index':
+        """
+            Index of a **processed** collection given in batches, see `vsm.iter_processed_data`.
+            Only the term frequencies of each document are kept: a batch can be dropped
+            as soon as the next one is requested.
+        """
+        index = cls(refresh_every)
+        tf, df = index._tf, index.df
+        for batch in batches:
+            for d in batch:
+                tokens = d['title_tokens'] + d['overview_tokens']
+                tf[d['docID']] = term_frequencies(tokens)
+                for t in dict.fromkeys(tokens):     # same term order of `vsm.compute_df`
+                    df[t] = df.get(t, 0) + 1
+        index.refresh()
+        return index
+
+    @classmethod
+    def from_snapshot(cls, snapshot, refresh_every : int | None = REFRESH_EVERY) -> 'Index':
+        """
+            **Mapped** index of a `snapshot.Snapshot`, weights are taken as they are.
+        """
+        index = cls(refresh_every)
+        index.snapshot = snapshot
+        index.vocabulary = vector.Vocabulary(snapshot.vocabulary())
+        index.df = dict(zip(index.vocabulary.terms, snapshot.df_counts.tolist()))
+        return index
+
+    # UPDATES
+    def prepare(self, doc : dict) -> tuple[int, dict]:
+        """
+            The (`docID`, `tf`) of the (raw) document `doc`, without touching the index.
+            Raises `KeyError`, `TypeError` or `ValueError` if `doc` is not a valid document.
+        """
+        doc_id = int(doc['docID'])
+        title, overview = doc[vsm.TITLE], doc[vsm.OVERVIEW]
+        if not isinstance(title, str) or not isinstance(overview, str):
+            raise TypeError(f'{vsm.TITLE} and {vsm.OVERVIEW} must be strings')
+        return doc_id, term_frequencies(vsm.tokenize(title) + vsm.tokenize(overview))
+
+    def add(self, doc : dict) -> None:
+        """
+            Adds the (raw) document `doc`, it must have a `docID` not in the index.
+        """
+        self.insert([self.prepare(doc)])
+
+    def insert(self, documents : list[tuple[int, dict]]) -> None:
+        """
+            Adds the `prepare`d documents, all or none: raises `ValueError`, before adding
+            any of them, if a docID is already in the index or repeated.
+        """
+        with self.lock:
+            ids = [doc_id for doc_id, _ in documents]
+            if len(set(ids)) < len(ids) or any(doc_id in self.tf for doc_id in ids):
+                raise ValueError('docID already indexed')
+            for doc_id, tf in documents:
+                self._insert(doc_id, tf)
+                self._changed()
+
+    def _insert(self, doc_id : int, tf : dict) -> None:
+        self.tf[doc_id] = tf
+        for t in tf:
+            self.df[t] = self.df.get(t, 0) + 1
+
+        vec = self.tf_idf[doc_id] = self._weights(tf)
+        if vec:
+            self.norms[doc_id] = norm = float(np.linalg.norm(list(vec.values())))
+            for t, w in vec.items():
+                insort(self.postings.setdefault(t, []), (doc_id, w))
+                bound = (w / norm if norm else 0., doc_id)
+                if t not in self.max_weights or bound[0] > self.max_weights[t][0]:
+                    self.max_weights[t] = bound
+
+    def delete(self, doc_id : int) -> None:
+        """
+            Removes the document `doc_id` from the index.
+        """
+        with self.lock:
+            self._remove(doc_id)
+            self._changed()
+
+    def _remove(self, doc_id : int) -> None:
+        tf = self.tf.pop(doc_id)
+        vec = self.tf_idf.pop(doc_id)
+        self.norms.pop(doc_id, None)
+
+        for t in tf:
+            if (df := self.df[t] - 1) == 0:
+                del self.df[t]
+            else:
+                self.df[t] = df
+
+        for t in vec:
+            postings = self.postings[t]
+            del postings[bisect_left(postings, (doc_id,))]
+            if not postings:
+                del self.postings[t]
+                del self.max_weights[t]
+            elif self.max_weights[t][1] == doc_id:
+                self.max_weights[t] = vsm.compute_max_weights({t : postings}, self.norms)[t]
+
+    def update(self, doc : dict) -> None:
+        """
+            Replaces the document with the `docID` of `doc`: it is validated (see `prepare`)
+            before the old one is removed, a `KeyError` is raised if `docID` is not indexed.
+        """
+        doc_id, tf = self.prepare(doc)
+        with self.lock:
+            if doc_id not in self.tf:
+                raise KeyError(doc_id)
+            self._remove(doc_id)
+            self._insert(doc_id, tf)
+            self._changed()
+
+    def refresh(self) -> None:
+        """
+            Recomputes every weight with the current idf.
+        """
+        with self.lock:
+            self._tf_idf = {doc_id : self._weights(tf) for doc_id, tf in self.tf.items()}
+            self._postings = vsm.compute_postings(self._tf_idf)
+            self._norms = vsm.compute_norms(self._tf_idf)
+            self._max_weights = vsm.compute_max_weights(self._postings, self._norms)
+            self.pending = 0
+            self.version += 1
+            self._csr = None
+            self._compressed = None
+
+    def _weights(self, tf : dict) -> dict:
+        N = self.collection_size
+        return {t : v * np.log((N + 1) / (self.df.get(t, 0) + 1)) for t, v in tf.items()}
+
+    def _changed(self) -> None:
+        self.pending += 1
+        self.version += 1
+        self._csr = None
+        self._compressed = None
+        if self.refresh_every is not None and self.pending >= self.refresh_every:
+            self.refresh()
+
+    # SCORING
+    def csr_model(self) -> csr.CSRModel:
+        """
+            The `csr.CSRModel` of the current weights, built on first use.
+        """
+        with self.lock:
+            if self._csr is None:
+                self._csr = self.snapshot.csr_model() if self.mapped else csr.CSRModel(self.tf_idf)
+            return self._csr
+
+    def lsa_index(self) -> lsa.LSAIndex:
+        """
+            The `lsa.LSAIndex` (embeddings & ANN lists) of the weights, built on first use.
+            It is built without holding `lock`: after a change the previous one keeps
+            answering while the new one is built in a background thread.
+        """
+        with self.lock:
+            while self._lsa is None and self._lsa_building:
+                self._lsa_built.wait()
+            ann = self._lsa
+            if self._lsa_building or self._lsa_version == self.version:
+                return ann
+            self._lsa_building = True
+            model, version = self.csr_model(), self.version
+
+        if ann is None:
+            return self._build_lsa(model, version)
+        threading.Thread(target=self._build_lsa, args=(model, version), daemon=True).start()
+        return ann
+
+    def _build_lsa(self, model : csr.CSRModel, version : int) -> lsa.LSAIndex | None:
+        ann = None
+        try:
+            ann = lsa.LSAIndex(model)
+            return ann
+        finally:
+            with self.lock:
+                if ann is not None:
+                    self._lsa, self._lsa_version = ann, version
+                self._lsa_building = False
+                self._lsa_built.notify_all()
+
+    def compressed_postings(self) -> compressed.CompressedPostings:
+        """
+            The `compressed.CompressedPostings` (`compressed.BITS` impacts) of the current weights, built on first
+            use (a mapped index reads them from its snapshot).
+        """
+        with self.lock:
+            if self._compressed is None:
+                self._compressed = self.snapshot.compressed_postings() if self.mapped else compressed.CompressedPostings(self.csr_model())
+            return self._compressed
+
+    def sharded_scorer(self) -> shards.ShardedScorer:
+        """
+            The `shards.ShardedScorer` of the current weights: its `n_shards` workers
+            are started on first use, and get the new shards after each change.
+        """
+        with self.lock:
+            if self._sharded is None:
+                self._sharded = shards.ShardedScorer(n_shards=self.n_shards)
+            if self._sharded.version != self.version:
+                self._sharded.load(self.csr_model(), self.version)
+            return self._sharded
+
+    def close(self) -> None:
+        """
+            Stops the workers of `sharded_scorer` and frees their shared memory, if started.
+        """
+        with self.lock:
+            if self._sharded is not None:
+                self._sharded.close()
+                self._sharded = None
+
+    def score(
+            self,
+            query : dict,
+            k : int = -1,
+            backend : str = 'postings',
+            candidates : int | None = None,
+            rerank : bool = True
+        ) -> dict:
+        """
+            Cosine similarity {`docID`->`score`} between `query` and every (non empty) document.
+            If `k` is not -1 only the **top k** are returned, sorted by decreasing score.
+            `backend` is 'postings' (inverted index), 'csr' (sparse matrix), 'sharded'
+            (the CSR matrix split over `n_shards` processes, same results of 'csr') or
+            'compressed' (varint postings with quantised weights, approximate scores).
+            With `candidates` only that many approximate neighbours of `query` are scored
+            (see `lsa.LSAIndex.score`), by exact cosine if `rerank` else in the LSA space.
+        """
+        metrics.count('query_terms_total', len(query))
+        if candidates:
+            ann = self.lsa_index()
+            metrics.count('documents_scored_total', candidates)
+            with metrics.stage('score'):
+                return ann.score(query, k, candidates, rerank)
+        if backend == 'sharded':
+            scorer = self.sharded_scorer()
+            metrics.count('documents_scored_total', len(scorer.model.doc_ids))
+            with metrics.stage('score'):
+                return scorer.score(query, k)
+
+        if backend == 'compressed':
+            postings = self.compressed_postings()
+            metrics.count('documents_scored_total', len(postings.doc_ids))
+            with metrics.stage('score'):
+                scores = postings.score(query)
+            with metrics.stage('sort'):
+                return postings.rank(scores, k)
+
+        if backend == 'csr' or self.mapped:        # the maps of a mapped index are not built to score
+            model = self.csr_model()
+            metrics.count('documents_scored_total', len(model.doc_ids))
+            with metrics.stage('score'):
+                scores = model.score(query)
+            with metrics.stage('sort'):
+                return model.rank(scores, k)
+
+        with self.lock:
+            metrics.count('documents_scored_total', len(self.norms))
+            with metrics.stage('score'):
+                if k > 0 and (rank := vsm.top_k(query, k, self.tf_idf, self.postings, self.norms, self.max_weights)) is not None:
+                    return dict(rank)
+
+                # long queries: the CSR matrix, if it is up to date, is faster than the postings
+                if (model := self._csr) is None:
+                    result = dict.fromkeys(self.norms, 0.)
+                    result.update(vsm.score(query, self.postings, self.norms))
+
+        if model is not None:
+            with metrics.stage('score'):
+                scores = model.score(query)
+            with metrics.stage('sort'):
+                return model.rank(scores, k)
+
+        if k == -1:
+            return result
+
+        with metrics.stage('sort'):
+            rank = list(result.items())
+            rank.sort(key=lambda x: (-x[1], x[0]))
+            return dict(rank[:min(k, len(rank))])
+
+    def score_batch(self, queries : list[dict], k : int | list[int] = -1) -> list[dict]:
+        """
+            `score` of many queries with a **single** sparse product of the CSR backend.
+            `k` is the same for every query or one per query.
+        """
+        ks = k if isinstance(k, list) else [k] * len(queries)
+        model = self.csr_model()
+        metrics.count('query_terms_total', sum(len(q) for q in queries))
+        metrics.count('documents_scored_total', len(model.doc_ids) * len(queries))
+        with metrics.stage('score'):
+            S = model.score_batch(queries)
+        with metrics.stage('sort'):
+            return [model.rank(S[i].toarray()[0], ks[i]) for i in range(len(queries))]
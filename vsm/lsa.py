@@ -0,0 +1,187 @@
+"""
+    **Low-rank** retrieval mode: the L2-normalised tf-idf matrix of a `csr.CSRModel` is
+    reduced to `dim`-dimensional document embeddings (truncated SVD, i.e. LSA, or a
+    random projection) kept as one contiguous float32 array, with an **IVF** index on
+    top (spherical k-means lists). A query visits only the `n_probe` closest lists.
+
+        python lsa.py       # recall against exact search & latency report
+"""
+import time
+import numpy as np
+
+from scipy.sparse.linalg import svds
+
+import csr
+
+# CONSTANTS
+DIM = 128
+N_PROBE = 8
+CANDIDATES = 200
+KMEANS_ITERATIONS = 10
+SEED = 42
+
+class LSAIndex:
+    """
+        `dim`-dimensional embeddings of the documents of `model` with an IVF index:
+            - `projection`: (V x dim) float32, maps a normalised query row to its embedding.
+            - `embeddings`: (N x dim) float32, L2-normalised, rows follow `model.doc_ids`.
+            - `centroids`: (lists x dim) float32, the k-means centroids.
+            - `order`, `offsets`: the rows of list `i` are `order[offsets[i]:offsets[i + 1]]`.
+        `method` is 'svd' (LSA) or 'random' (Gaussian random projection).
+    """
+
+    def __init__(
+            self,
+            model : csr.CSRModel,
+            dim : int = DIM,
+            method : str = 'svd',
+            n_lists : int | None = None,
+            seed : int = SEED
+        ):
+        self.model = model
+        rng = np.random.default_rng(seed)
+        N, V = model.matrix.shape
+        dim = max(1, min(dim, N - 1, V - 1))
+
+        if method == 'svd':
+            # M ~ U S Vt, documents are U S = M Vt.T: queries are projected the same way
+            _, _, vt = svds(model.matrix.astype(np.float64), k=dim, random_state=seed)
+            self.projection = np.ascontiguousarray(vt.T, dtype=np.float32)
+        elif method == 'random':
+            self.projection = (rng.standard_normal((V, dim)) / np.sqrt(dim)).astype(np.float32)
+        else:
+            raise ValueError(f'unknown method {method}')
+
+        self.embeddings = normalise(np.asarray(model.matrix @ self.projection, dtype=np.float32))
+        self._cluster(n_lists or max(1, int(np.sqrt(N))), rng)
+
+    def _cluster(self, n_lists : int, rng) -> None:
+        """
+            Spherical k-means of the embeddings into `n_lists` inverted lists.
+        """
+        E = self.embeddings
+        n_lists = min(n_lists, len(E))
+        centroids = E[rng.choice(len(E), size=n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(E @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, E)
+            empty = ~sums.any(axis=1)
+            sums[empty] = E[rng.choice(len(E), size=int(empty.sum()))]
+            centroids = normalise(sums)
+
+        assignment = np.argmax(E @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.searchsorted(assignment[self.order], np.arange(n_lists + 1))
+
+    def embed(self, queries : list[dict]) -> np.ndarray:
+        """
+            (`len(queries)` x dim) normalised float32 embeddings of **sparse** queries.
+        """
+        # Gathers the projection rows of the query terms: a sparse @ dense product
+        # would cast the whole float32 projection to the query dtype
+        Q = self.model.query_matrix(queries)
+        rows = np.repeat(np.arange(len(queries)), np.diff(Q.indptr))
+        E = np.zeros((len(queries), self.projection.shape[1]), dtype=np.float32)
+        np.add.at(E, rows, self.projection[Q.indices] * Q.data[:, None].astype(np.float32))
+        return normalise(E)
+
+    def search(self, embedding : np.ndarray, n : int = CANDIDATES, n_probe : int = N_PROBE) -> tuple[np.ndarray, np.ndarray]:
+        """
+            The (at most) `n` rows closest to `embedding` among the `n_probe` closest lists,
+            and their approximate cosine similarity, by decreasing similarity.
+        """
+        probe = np.argsort(-(self.centroids @ embedding))[:n_probe]
+        rows = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in probe])
+        scores = self.embeddings[rows] @ embedding
+        if len(rows) > n:
+            top = np.argpartition(-scores, n - 1)[:n]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order]
+
+    def score(self, query : dict, k : int, candidates : int = CANDIDATES, rerank : bool = True, n_probe : int = N_PROBE) -> dict:
+        """
+            **Top k** {`docID`->`score`} of `query` among its ANN `candidates`: with `rerank`
+            the candidates are ranked by their exact cosine similarity, otherwise by the
+            cosine similarity of the embeddings.
+        """
+        if not query:
+            return {}
+        rows, scores = self.search(self.embed([query])[0], max(candidates, k), n_probe)
+        if rerank:
+            scores = (self.model.matrix[rows] @ self.model.query_matrix([query]).T).toarray()[:, 0]
+        doc_ids = self.model.doc_ids[rows]
+        order = np.lexsort((doc_ids, -scores))[:k if k >= 0 else len(rows)]
+        return {int(doc_ids[i]) : float(scores[i]) for i in order}
+
+def normalise(X : np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return np.ascontiguousarray(X / np.where(norms > 0, norms, 1), dtype=np.float32)
+
+def report(idx, queries : list[dict], k : int = 10, candidates : int = CANDIDATES, n_probe : int = N_PROBE, **params) -> dict:
+    """
+        Recall@`k` of the ANN top k against the exact top k (with & without re-ranking)
+        and the mean latency of each, on `queries`.
+    """
+    model = idx.csr_model()
+    start = time.perf_counter()
+    ann = LSAIndex(model, **params)
+    build = time.perf_counter() - start
+
+    def timed(fn):
+        start = time.perf_counter()
+        results = [fn(q) for q in queries]
+        return results, (time.perf_counter() - start) / len(queries)
+
+    exact, exact_s = timed(lambda q: idx.score(q, k, 'csr'))
+    approx, approx_s = timed(lambda q: ann.score(q, k, candidates, False, n_probe))
+    reranked, rerank_s = timed(lambda q: ann.score(q, k, candidates, True, n_probe))
+
+    def recall(results):
+        return float(np.mean([len(set(r) & set(e)) / len(e) for r, e in zip(results, exact) if e]))
+
+    return {
+        'documents' : len(model.doc_ids),
+        'dim' : ann.embeddings.shape[1],
+        'lists' : len(ann.centroids),
+        'n_probe' : n_probe,
+        'candidates' : candidates,
+        'build_s' : build,
+        f'recall@{k}' : recall(approx),
+        f'recall@{k}_rerank' : recall(reranked),
+        'exact_ms' : exact_s * 1e3,
+        'ann_ms' : approx_s * 1e3,
+        'ann_rerank_ms' : rerank_s * 1e3,
+    }
+
+
+if __name__ == '__main__':
+    import json
+    import random
+    import argparse
+
+    import index
+    import snapshot
+
+    parser = argparse.ArgumentParser(description='Recall & latency of the LSA / IVF mode against exact search.')
+    parser.add_argument('--dim', type=int, default=DIM)
+    parser.add_argument('--method', default='svd', choices=['svd', 'random'])
+    parser.add_argument('--n-probe', type=int, default=N_PROBE)
+    parser.add_argument('--candidates', type=int, default=CANDIDATES)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    idx = index.Index.from_snapshot(snapshot.load_or_build(log=True))
+    # Queries of a few terms of random documents, weighted as in their document
+    rng = random.Random(SEED)
+    queries = []
+    for d in rng.sample([d for d, vec in idx.tf_idf.items() if vec], args.queries):
+        terms = rng.sample(list(idx.tf_idf[d]), min(5, len(idx.tf_idf[d])))
+        queries.append({t : idx.tf_idf[d][t] for t in terms})
+
+    print(json.dumps(report(
+        idx, queries, args.k, args.candidates, args.n_probe, dim=args.dim, method=args.method
+    ), indent=2))
@@ -0,0 +1,180 @@
+"""
+    Optional instrumentation: stage timers, latency histograms and counters,
+    rendered in the Prometheus text format by `render`.
+
+    Everything is a no-op until `enable` is called: `stage` returns a shared
+    null context and `count` / `observe` return at once.
+"""
+import time
+import threading
+
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# CONSTANTS
+PREFIX = 'vsm_'
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+ENABLED = False
+SERVER_TIMING = False
+
+_NULL = nullcontext()
+_LOCK = threading.Lock()
+_COUNTERS = {}      # (name, labels) -> value
+_HISTOGRAMS = {}    # (name, labels) -> Histogram
+_HELP = {
+    'requests_total' : ('counter', 'HTTP requests, by endpoint and status.'),
+    'request_seconds' : ('histogram', 'HTTP request latency, by endpoint.'),
+    'stage_seconds' : ('histogram', 'Latency of each processing stage.'),
+    'query_terms_total' : ('counter', 'Terms of the scored queries.'),
+    'feedback_documents_total' : ('counter', 'Documents of the feedback sets, by kind.'),
+    'documents_scored_total' : ('counter', 'Documents scored.'),
+}
+_local = threading.local()
+
+class Histogram:
+    """
+        Cumulative histogram with fixed `buckets` (upper bounds, `+Inf` is implicit).
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets : tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value : float) -> None:
+        if (i := bisect_left(self.buckets, value)) < len(self.buckets):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+def enable(server_timing : bool = False) -> None:
+    """
+        Turns the instrumentation on, with the `Server-Timing` header if `server_timing`.
+    """
+    global ENABLED, SERVER_TIMING
+    ENABLED = True
+    SERVER_TIMING = server_timing
+
+def disable() -> None:
+    global ENABLED, SERVER_TIMING
+    ENABLED = False
+    SERVER_TIMING = False
+
+def reset() -> None:
+    with _LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+
+def count(name : str, value : int | float = 1, **labels) -> None:
+    """
+        Adds `value` to the counter `name`.
+    """
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+def observe(name : str, value : float, **labels) -> None:
+    """
+        Adds `value` to the histogram `name`.
+    """
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _LOCK:
+        if (h := _HISTOGRAMS.get(key)) is None:
+            h = _HISTOGRAMS[key] = Histogram()
+        h.observe(value)
+
+def stage(name : str):
+    """
+        Context manager timing the stage `name` into `stage_seconds`
+        and into the timings of the current request (see `begin`).
+    """
+    return _stage(name) if ENABLED else _NULL
+
+@contextmanager
+def _stage(name : str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('stage_seconds', elapsed, stage=name)
+        if (timings := getattr(_local, 'timings', None)) is not None:
+            timings.append((name, elapsed))
+
+# REQUESTS
+def begin() -> None:
+    """
+        Starts collecting the stage timings of the request served by this thread.
+    """
+    _local.timings = []
+    _local.start = time.perf_counter()
+
+def end(endpoint : str, status : int) -> list[tuple]:
+    """
+        Records the request started by `begin`, returns its [(`stage`, `seconds`)]
+        timings followed by ('total', `seconds`).
+    """
+    timings = getattr(_local, 'timings', None) or []
+    start = getattr(_local, 'start', None)
+    _local.timings = _local.start = None
+    if start is None:
+        return timings
+    elapsed = time.perf_counter() - start
+    count('requests_total', endpoint=endpoint, status=str(status))
+    observe('request_seconds', elapsed, endpoint=endpoint)
+    return timings + [('total', elapsed)]
+
+def server_timing(timings : list[tuple]) -> str:
+    """
+        `Server-Timing` header value of `timings`, durations in milliseconds.
+    """
+    return ', '.join(f'{name};dur={seconds * 1e3:.3f}' for name, seconds in timings)
+
+# EXPOSITION
+def render() -> str:
+    """
+        Every metric in the Prometheus text format.
+    """
+    with _LOCK:
+        counters = sorted(_COUNTERS.items())
+        histograms = sorted(
+            (key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in _HISTOGRAMS.items()
+        )
+
+    lines = []
+    described = set()
+    def describe(name):
+        if name not in described and name in _HELP:
+            kind, text = _HELP[name]
+            lines.append(f'# HELP {PREFIX}{name} {text}')
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        described.add(name)
+
+    for (name, labels), value in counters:
+        describe(name)
+        lines.append(f'{PREFIX}{name}{_labels(labels)} {value}')
+
+    for (name, labels), (buckets, counts, total, n) in histograms:
+        describe(name)
+        cumulative = 0
+        for bound, c in zip(buckets, counts):
+            cumulative += c
+            lines.append(f'{PREFIX}{name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+        lines.append(f'{PREFIX}{name}_bucket{_labels(labels + (("le", "+Inf"),))} {n}')
+        lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {total}')
+        lines.append(f'{PREFIX}{name}_count{_labels(labels)} {n}')
+
+    return '\n'.join(lines) + '\n'
+
+def _labels(labels : tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
@@ -1,46 +1,284 @@
-from flask import Flask, abort, request 
-import requests
+from flask import Flask, Response, abort, g, request
 import vsm
+import index
+import feedback
+import cache
+import formats
+import metrics
+import sessions
+import holder
 
 app = Flask(__name__)
 
-DATA = vsm.load_processed_data(log=True)
-DF = vsm.compute_df(DATA)
-TF_IDF = vsm.compute_tfidf(DATA, DF)
+# Scoring backend of `/score`: 'csr' (sparse matrix), 'sharded' (the sparse matrix split over
+# `SHARDS` processes) or 'compressed' (varint postings with 8-bit weights, about 4x smaller than
+# 'csr', approximate scores). The served index is a mapped snapshot: 'postings' would score on 'csr'
+BACKEND = 'csr'
+SHARDS = 4
 
-URL = 'http://127.0.0.1:5000'
+# The current generation of the index, `None` until the first one is loaded
+INDEX = None
+
+def set_index(idx : index.Index) -> None:
+    global INDEX
+    INDEX = idx
+
+# Generations of `INDEX`: the snapshot is served if up to date, otherwise it is rebuilt in the
+# background (and on `/admin/rebuild`) and swapped in, meanwhile `/ready` answers 503
+HOLDER = holder.IndexHolder(n_shards=SHARDS, on_swap=set_index)
+HOLDER.load(log=True)
+
+# Endpoints served without an index, e.g. while the first generation is built
+NO_INDEX = {'cache_stats', 'prometheus_metrics', 'rebuild', 'health', 'ready'}
+
+# Caches of query text -> vector and of request -> result, emptied at each index change
+QUERY_CACHE = cache.Cache(max_bytes=16 << 20, ttl=3600)
+RESULT_CACHE = cache.Cache(max_bytes=64 << 20, ttl=300)
+
+# Relevance feedback sessions, least recently used ones evicted past the budget
+SESSIONS = sessions.SessionStore(max_bytes=32 << 20, ttl=1800)
+
+# Largest number of queries of a batch request
+MAX_BATCH = 1000
+
+# Per-stage instrumentation exposed on `/metrics`, and as a `Server-Timing` header
+METRICS = False
+SERVER_TIMING = False
+if METRICS:
+    metrics.enable(SERVER_TIMING)
 
 def get_vector(ids) -> dict:
     """
         Given a list of **docID**s returns their **sparse** vectore representation.
     """
-    result = {}
-    for id in ids:
-        if (vec := TF_IDF.get(id, None)):
-            result[id] = vec
-    return result
-
-def rocchio(
-        query : dict,
-        relevants : list[dict] = [],
-        non_relevants : list[dict] = [],
-        alpha : float = .3,
-        beta : float = .3,
-        gamma : float = .3
-    ) -> dict:
-
-    C_r = vsm.mean(relevants)
-    C_nr = vsm.mean(non_relevants)
-    
-    q = vsm.mult(query, alpha)
+    return feedback.get_vectors(g.index, ids)
 
-    C_r = vsm.mult(C_r, beta)
-    q = vsm.add(q, C_r)
+rocchio = feedback.rocchio
 
-    C_nr = vsm.mult(C_nr, gamma)
-    q = vsm.sub(q, C_nr)
-    
-    return q
+def expansion_params(data : dict) -> dict:
+    """
+        The optional truncation parameters of a Rocchio query expansion request.
+    """
+    max_terms = data.get('max-terms', None)
+    return {
+        'max_terms' : None if max_terms is None else int(max_terms),
+        'drop_negative' : bool(data.get('drop-negative', False)),
+    }
+
+def ann_params(data : dict) -> dict:
+    """
+        The optional approximate (LSA / IVF) scoring parameters of a request.
+    """
+    candidates = data.get('candidates', None)
+    return {
+        'candidates' : None if candidates is None else int(candidates),
+        'rerank' : bool(data.get('rerank', True)),
+    }
+
+def rf_score_request(data : dict) -> dict:
+    """
+        The `feedback.rf_score` keyword arguments of a `/rf_score` json body.
+    """
+    return {
+        'fields' : data.get('fields', dict()),
+        'relevants' : [int(d) for d in data.get('relevants', [])],
+        'non_relevants' : [int(d) for d in data.get('non-relevants', [])],
+        'k' : int(data.get('k', -1)),
+        **expansion_params(data),
+        **ann_params(data),
+    }
+
+def score_request(data : dict) -> dict:
+    """
+        The `index.Index.score` arguments of a `/score` json body.
+    """
+    query = data.get('query', dict())
+    return {
+        'query' : {str(t) : float(w) for t, w in query.items()},
+        'k' : int(data.get('k', -1)),
+        **ann_params(data),
+    }
+
+def rf_score_key(r : dict, backend : str) -> tuple:
+    """
+        `RESULT_CACHE` key of a `rf_score_request`.
+    """
+    fields = r['fields']
+    return (
+        'rf_score',
+        cache.normalise(fields.get(vsm.TITLE, '') + fields.get(vsm.OVERVIEW, '')),
+        frozenset(r['relevants']),
+        frozenset(r['non_relevants']),
+        r['k'],
+        result_backend(backend),
+        r['max_terms'],
+        r['drop_negative'],
+        r['candidates'],
+        r['rerank']
+    )
+
+def score_key(query : dict, k : int, backend : str, candidates : int | None = None, rerank : bool = True) -> tuple:
+    """
+        `RESULT_CACHE` key of a `/score` request.
+    """
+    return ('score', cache.vector_key(query), k, result_backend(backend), candidates, rerank)
+
+def result_backend(backend : str) -> str:
+    """
+        The backend in the `RESULT_CACHE` keys of requests scored with `backend`: on the served
+        (mapped) index every backend but 'compressed' gives the scores of 'csr', so that the
+        single and the batch endpoints share their results.
+    """
+    return 'compressed' if backend == 'compressed' else 'csr'
+
+def score_requests(requests : list[dict]) -> list[dict]:
+    """
+        `INDEX.score` of many `score_request`s: the exact ones together with one
+        `INDEX.score_batch`, the approximate ones (with `candidates`) one by one.
+    """
+    results = [None] * len(requests)
+    exact = []
+    for i, r in enumerate(requests):
+        if r['candidates']:
+            results[i] = g.index.score(**r)
+        else:
+            exact.append(i)
+    batch = g.index.score_batch([requests[i]['query'] for i in exact], [requests[i]['k'] for i in exact]) if exact else []
+    for i, result in zip(exact, batch):
+        results[i] = result
+    return results
+
+# BATCH REQUESTS
+class BatchError:
+    """
+        Error of one query of a batch request.
+    """
+    def __init__(self, error : Exception):
+        self.message = f'{type(error).__name__}: {error}'
+
+def batch_items(parse, key, bare : str | None = None) -> list:
+    """
+        The queries of a batch request: its json body has a `queries` list and, optionally,
+        the default value of any other field of the single query request (e.g. `k`).
+        Each query is an object with the fields of the single query request (or, if `bare`
+        is given, a value of the field `bare`) and is `parse`d, with the defaults it does
+        not override, into a (`key`, request) pair. A query that can not be parsed is
+        replaced by its `BatchError`.
+    """
+    content_type = request.headers.get('Content-Type')
+    if content_type != 'application/json':
+        abort(400)
+
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(queries := data.pop('queries', None), list):
+        abort(400)
+    if len(queries) > MAX_BATCH:
+        abort(413)
+
+    items = []
+    for q in queries:
+        try:
+            if not isinstance(q, dict):
+                if bare is None:
+                    raise TypeError('a query must be an object')
+                q = {bare : q}
+            r = parse({**data, **q})
+            items.append((key(r), r))
+        except (ValueError, TypeError, AttributeError) as e:
+            items.append(BatchError(e))
+    return items
+
+def batch_results(items : list, compute) -> list:
+    """
+        The result of each item of `batch_items` through `RESULT_CACHE`: `compute` is called
+        once with the (distinct) requests missing from the cache and returns their results.
+        If it fails each request is computed alone, the ones that still fail get a `BatchError`.
+    """
+    version = g.index.version
+    results = list(items)
+    missing = {}
+    for i, item in enumerate(items):
+        if isinstance(item, BatchError):
+            continue
+        key, r = item
+        if (result := RESULT_CACHE.get(key, version)) is not None:
+            results[i] = result
+        else:
+            missing.setdefault(key, (r, []))[1].append(i)
+
+    if missing:
+        requests = [r for r, _ in missing.values()]
+        try:
+            computed = compute(requests)
+        except Exception:
+            # one failing query must not fail the others: each one is computed on its own
+            computed = []
+            for r in requests:
+                try:
+                    computed.extend(compute([r]))
+                except Exception as e:
+                    computed.append(BatchError(e))
+        for (key, (_, positions)), result in zip(missing.items(), computed):
+            if not isinstance(result, BatchError):
+                RESULT_CACHE.put(key, result, version)
+            for i in positions:
+                results[i] = result
+    return results
+
+def batch_response(results : list):
+    """
+        The json response of a batch request, one entry per query in request order:
+        `{"result" : ...}` or `{"error" : message}`.
+    """
+    with metrics.stage('encode'):
+        return app.json.response({
+            'results' : [
+                {'error' : r.message} if isinstance(r, BatchError) else {'result' : r}
+                for r in results
+            ]
+        })
+
+def respond(result : dict, scores : bool = True):
+    """
+        Encodes `result` in the format asked by the `Accept` header (JSON by default).
+        `scores` tells if `result` is a {`docID`->`score`} map or a map of vectors.
+    """
+    mimetype = request.accept_mimetypes.best_match(formats.available(scores), default=formats.JSON)
+    if mimetype == formats.NDJSON:
+        lines = formats.ndjson_scores(result) if scores else formats.ndjson_vectors(result)
+        return Response(lines, mimetype=mimetype)
+    with metrics.stage('encode'):
+        if mimetype == formats.MSGPACK:
+            return Response(formats.encode_msgpack(result), mimetype=mimetype)
+        if mimetype == formats.BINARY:
+            return Response(formats.encode_scores(result), mimetype=mimetype)
+        return app.json.response(result)
+
+@app.before_request
+def begin_metrics():
+    if metrics.ENABLED:
+        metrics.begin()
+
+@app.before_request
+def bind_index():
+    # A request is served by one generation of the index, even if a rebuild swaps it:
+    # that generation is closed only once its last request is done
+    g.index = HOLDER.acquire()
+    if g.index is None and request.endpoint is not None and request.endpoint not in NO_INDEX:
+        abort(503)
+
+@app.teardown_request
+def release_index(error):
+    if (idx := g.pop('index', None)) is not None:
+        HOLDER.release(idx)
+
+@app.after_request
+def end_metrics(response):
+    if metrics.ENABLED:
+        timings = metrics.end(request.url_rule.rule if request.url_rule else 'unmatched', response.status_code)
+        if metrics.SERVER_TIMING and timings:
+            response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
 
 
 #### APIs
@@ -53,6 +291,10 @@ def rf_score():
             - `relevants`: a list of **relevants** docIDs.
             - `non-relevents`: a list of **relevants** docIDs.
             - `k`: filter the **top k**.
+            - `max-terms`: (optional) keep only the heaviest terms of the expanded query.
+            - `drop-negative`: (optional) remove the negative terms of the expanded query.
+            - `candidates`: (optional) score only this many approximate neighbours (LSA / IVF).
+            - `rerank`: (optional, default true) rank the candidates by exact cosine similarity.
     """
 
     content_type = request.headers.get('Content-Type')
@@ -62,45 +304,16 @@ def rf_score():
     if not (data := request.get_json()):
         abort(400)
 
-    query = data.get('fields', dict())
-    relevants = data.get('relevants', [])
-    non_relevants = data.get('non-relevants', [])
-    k = int(data.get('k', -1))
-    
-    query_str = query.get(vsm.TITLE, '') + query.get(vsm.OVERVIEW, '')
-    query_vec = vsm.query2vec(query_str, DF)
-
-    headers = {'Content-Type' : 'application/json'}
-    r = requests.post(
-        f'{URL}/rocchio',
-        json = {
-            'query' : query_vec,
-            'relevants' : relevants,
-            'non-relevants' : non_relevants
-        },
-        headers = headers
-    )
-
-    if r.status_code != 200:
-        abort(r.status_code)
-
-    new_query_vec = r.json()
-
-    r = requests.post(
-        f'{URL}/score',
-        json = {
-            'query' : new_query_vec,
-            'k' : k
-        },
-        headers = headers
-    )
-
-    if r.status_code != 200:
-        abort(r.status_code)
-
-    score = r.json()
-
-    return score
+    try:
+        r = rf_score_request(data)
+        key = rf_score_key(r, BACKEND)
+    except (ValueError, TypeError, AttributeError):
+        abort(400)
+    if (result := RESULT_CACHE.get(key, g.index.version)) is None:
+        version = g.index.version
+        result = feedback.rf_score(g.index, backend=BACKEND, query_cache=QUERY_CACHE, **r)
+        RESULT_CACHE.put(key, result, version)
+    return respond(result)
 
 
 @app.route('/score', methods=['POST'])
@@ -109,7 +322,11 @@ def score():
         The post body is a json with this content:
             - `query`: a **sparse** representation of the query.
             - `k`: filter the **top k** docID. If absent or -1 returns all.
+            - `candidates`: (optional) score only this many approximate neighbours (LSA / IVF).
+            - `rerank`: (optional, default true) rank the candidates by exact cosine similarity.
         Returns a **map** s.t. for each docID we have the **cosine similarity**.
+        The response is JSON, unless the `Accept` header asks for `application/x-msgpack`,
+        `application/octet-stream` (see `formats.encode_scores`) or `application/x-ndjson` (streamed).
     """
     content_type = request.headers.get('Content-Type')
 
@@ -119,21 +336,122 @@ def score():
     if not (data := request.get_json()):
         abort(400)
 
-    query = data.get('query', dict())
-    result = {}
-    for doc in DATA:
-        id = int(doc['docID'])
-        if (vec := TF_IDF.get(id, None)):
-            result[id] = vsm.cosine_similarity(query, vec)
+    try:
+        r = score_request(data)
+    except (ValueError, TypeError, AttributeError):
+        abort(400)
 
-    k = int(data.get('k', -1))
+    key = score_key(r['query'], r['k'], BACKEND, r['candidates'], r['rerank'])
+    if (result := RESULT_CACHE.get(key, g.index.version)) is None:
+        version = g.index.version
+        result = g.index.score(backend=BACKEND, **r)
+        RESULT_CACHE.put(key, result, version)
+    return respond(result)
 
-    if k == -1:
-        return result
-    
-    rank = list(result.items())
-    rank.sort(key=lambda x: x[1], reverse=True)
-    return dict(rank[:min(k, len(rank))])
+@app.route('/score_batch', methods=['POST'])
+def score_batch():
+    """
+        Batch version of `/score`, the post body is a json with this content:
+            - `queries`: a list of `/score` bodies (`query` and optionally `k`, `candidates`, `rerank`).
+            - any other `/score` field: its default value for every query (e.g. `k`).
+        The exact queries are scored together with a single sparse product (see `index.Index.score_batch`).
+        Returns `{"results" : [...]}`: for each query, in request order, `{"result" : {docID : score}}`
+        or `{"error" : message}` if it is not valid.
+    """
+    items = batch_items(
+        score_request,
+        lambda r: score_key(r['query'], r['k'], 'csr', r['candidates'], r['rerank'])
+    )
+    return batch_response(batch_results(items, score_requests))
+
+@app.route('/rf_score_batch', methods=['POST'])
+def rf_score_batch():
+    """
+        Batch version of `/rf_score`, the post body is a json with this content:
+            - `queries`: a list of `/rf_score` bodies (`fields`, and optionally each query own
+              `relevants`, `non-relevants`, `k`, ...).
+            - any other `/rf_score` field: its default value for every query.
+        The query texts are vectorized once, the expanded queries scored together
+        (see `feedback.rf_score_batch`).
+        Returns `{"results" : [...]}` as `/score_batch`.
+    """
+    items = batch_items(rf_score_request, lambda r: rf_score_key(r, 'csr'))
+    return batch_response(batch_results(
+        items,
+        lambda requests: feedback.rf_score_batch(g.index, requests, QUERY_CACHE)
+    ))
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """
+        Starts a feedback session, the post body is a `/rf_score` json (`fields`, and optionally
+        `relevants`, `non-relevants`, `k`, `max-terms`, `drop-negative`, `candidates`, `rerank`).
+        Returns `{"session" : id, "result" : {docID : score}}`, the feedback is then sent to `/sessions/<id>`,
+        or 413 if the session alone is larger than the memory budget of the sessions.
+    """
+    content_type = request.headers.get('Content-Type')
+    if content_type != 'application/json':
+        abort(400)
+    if not isinstance(data := request.get_json(), dict):
+        abort(400)
+
+    try:
+        r = rf_score_request(data)
+        fields = r.pop('fields')
+        text = fields.get(vsm.TITLE, '') + fields.get(vsm.OVERVIEW, '')
+    except (ValueError, TypeError, AttributeError):
+        abort(400)
+
+    relevants, non_relevants = r.pop('relevants'), r.pop('non_relevants')
+    session = sessions.Session(g.index, text, query_cache=QUERY_CACHE, **r)
+    for doc_id in relevants:
+        session.mark(g.index, doc_id, sessions.RELEVANT)
+    for doc_id in non_relevants:
+        session.mark(g.index, doc_id, sessions.NON_RELEVANT)
+
+    if (session_id := SESSIONS.create(session)) is None:
+        abort(413)      # larger than the memory budget of every session
+    return {'session' : session_id, 'result' : session.score(g.index, BACKEND)}
+
+@app.route('/sessions/<session_id>', methods=['GET', 'POST', 'DELETE'])
+def session_feedback(session_id):
+    """
+        `POST` applies the feedback of a click (or a few) and returns the new ranking, as `/rf_score`:
+            - `relevants`: docIDs marked as relevant.
+            - `non-relevants`: docIDs marked as non relevant.
+            - `unmark`: docIDs without feedback anymore.
+        `GET` returns the feedback of the session, `DELETE` ends it. Each request restarts the session ttl,
+        a `POST` answers 413 (and ends the session) if it outgrows the memory budget of the sessions.
+    """
+    if (session := SESSIONS.get(session_id)) is None:
+        abort(404)
+
+    if request.method == 'DELETE':
+        SESSIONS.delete(session_id)
+        return {'session' : session_id}
+    if request.method == 'GET':
+        return {'session' : session_id, **session.state()}
+
+    content_type = request.headers.get('Content-Type')
+    if content_type != 'application/json':
+        abort(400)
+    if not isinstance(data := request.get_json(), dict):
+        abort(400)
+
+    try:
+        changes = [
+            (int(doc_id), kind)
+            for field, kind in (('unmark', None), ('relevants', sessions.RELEVANT), ('non-relevants', sessions.NON_RELEVANT))
+            for doc_id in data.get(field, [])
+        ]
+    except (ValueError, TypeError):
+        abort(400)
+
+    for doc_id, kind in changes:
+        session.mark(g.index, doc_id, kind)
+    if not SESSIONS.save(session_id, session):
+        abort(413)
+    return respond(session.score(g.index, BACKEND))
 
 @app.route('/rocchio', methods=['POST'])
 def relevance_feedback():
@@ -142,6 +460,8 @@ def relevance_feedback():
             - `query`: a **sparse** representation of the query.
             - `relevants`: a list of relevant document's doc ids.
             - `non-relevants`: a list of relevant document's doc ids.
+            - `max-terms`: (optional) keep only the heaviest terms of the new query.
+            - `drop-negative`: (optional) remove the negative terms of the new query.
         Returns a new query vecotr computed with [Rocchio's algorithm](https://en.wikipedia.org/wiki/Rocchio_algorithm).
     """
     content_type = request.headers.get('Content-Type')
@@ -156,11 +476,7 @@ def relevance_feedback():
     relevants = data.get('relevants', [])
     non_relevants = data.get('non-relevants', [])
 
-    relevant_vec = list(get_vector(relevants).values())
-    non_relevant_vec = list(get_vector(non_relevants).values())
-
-    new_query = rocchio(query_vec, relevant_vec, non_relevant_vec)
-    return new_query
+    return feedback.feedback_query(g.index, query_vec, relevants, non_relevants, **expansion_params(data))
 
 @app.route('/vectorize', methods=['POST'])
 def vectorize():
@@ -181,11 +497,32 @@ def vectorize():
     elif content_type == 'text/plain':
         query = request.get_data(as_text=True)
 
-    query_vec = vsm.query2vec(query, DF, len(TF_IDF))
+    query_vec = cache.query_vector(g.index, query, QUERY_CACHE)
     return query_vec
 
+@app.route('/vectorize_batch', methods=['POST'])
+def vectorize_batch():
+    """
+        Batch version of `/vectorize`: posting `{ "queries" : ["my query string", ...] }`
+        returns `{"results" : [...]}` with the **sparse** vector of each query, in request order,
+        as `{"result" : vector}` or `{"error" : message}` (see `/score_batch`).
+    """
+    def parse(data):
+        if not isinstance(query := data.get('query'), str):
+            raise TypeError('the query must be a string')
+        return query
+
+    items = batch_items(parse, cache.normalise, bare='query')
+    texts = [item[1] for item in items if not isinstance(item, BatchError)]
+    vectors = iter(cache.query_vectors(g.index, texts, QUERY_CACHE))
+    return batch_response([item if isinstance(item, BatchError) else next(vectors) for item in items])
+
 @app.route('/', methods=['POST'])
 def get_vectors():
+    """
+        Posting a json list of **docID**s returns their **sparse** vectors,
+        as JSON, `application/x-msgpack` or `application/x-ndjson` (streamed).
+    """
     content_type = request.headers.get('Content-Type')
     if content_type != 'application/json':
         abort(400)
@@ -193,4 +530,124 @@ def get_vectors():
     ids = request.get_json()
     vectors = get_vector(ids)
 
-    return vectors
+    return respond(vectors, scores=False)
+
+
+@app.route('/documents', methods=['POST'])
+def add_documents():
+    """
+        Indexes the posted document (or list of documents), each one must have
+        an unused `docID` and the `Series_Title` & `Overview` fields.
+    """
+    content_type = request.headers.get('Content-Type')
+    if content_type != 'application/json':
+        abort(400)
+
+    docs = request.get_json()
+    if isinstance(docs, dict):
+        docs = [docs]
+    if not docs or not isinstance(docs, list) or not all(isinstance(d, dict) for d in docs):
+        abort(400)
+
+    # every document is validated before any of them is added
+    try:
+        prepared = [g.index.prepare(doc) for doc in docs]
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    try:
+        g.index.insert(prepared)
+    except ValueError:
+        abort(409)
+    return status()
+
+@app.route('/documents/<int:doc_id>', methods=['PUT', 'DELETE'])
+def change_document(doc_id):
+    """
+        `PUT` replaces the document `doc_id` with the posted one, `DELETE` removes it.
+    """
+    if doc_id not in g.index:
+        abort(404)
+
+    if request.method == 'DELETE':
+        try:
+            g.index.delete(doc_id)
+        except KeyError:
+            abort(404)
+        return status()
+
+    content_type = request.headers.get('Content-Type')
+    if content_type != 'application/json':
+        abort(400)
+    if not isinstance(doc := request.get_json(), dict):
+        abort(400)
+
+    doc['docID'] = doc_id
+    try:
+        g.index.update(doc)
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    return status()
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    """
+        Recomputes every weight with the current idf.
+    """
+    g.index.refresh()
+    return status()
+
+@app.route('/cache', methods=['GET', 'DELETE'])
+def cache_stats():
+    """
+        `GET` returns the counters of the query & result caches (and of the feedback sessions),
+        `DELETE` empties the caches.
+    """
+    if request.method == 'DELETE':
+        QUERY_CACHE.clear()
+        RESULT_CACHE.clear()
+    return {'query' : QUERY_CACHE.stats(), 'result' : RESULT_CACHE.stats(), 'sessions' : SESSIONS.stats()}
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+        The instrumentation counters & histograms in the Prometheus text format
+        (empty unless `METRICS` is on).
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/rebuild', methods=['POST'])
+def rebuild():
+    """
+        Rebuilds the index from the collection file in the background, the current
+        generation keeps serving until the new one is swapped in (see `holder.IndexHolder`).
+        Returns 202, or 409 if a rebuild is already running.
+    """
+    if not HOLDER.rebuild():
+        return HOLDER.status(), 409
+    return HOLDER.status(), 202
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+        Liveness: the current generation of the index and the progress of the last rebuild.
+    """
+    return {'status' : 'ok', **HOLDER.status()}
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+        Readiness: 200 when an index generation is loaded (also while rebuilding), 503 otherwise.
+    """
+    if HOLDER.index is None:
+        return {'ready' : False, **HOLDER.status()}, 503
+    return {'ready' : True, **HOLDER.status()}
+
+def status() -> dict:
+    with g.index.lock:
+        return {
+            'generation' : HOLDER.generation,
+            'documents' : g.index.collection_size,
+            'terms' : len(g.index.df),
+            'version' : g.index.version,
+            'stale' : g.index.stale,
+        }
@@ -0,0 +1,167 @@
+"""
+    Server side **relevance feedback sessions**.
+
+    A session keeps the query vector and the running sums & counts of its relevant and
+    non relevant documents: marking or unmarking a document adds or subtracts its
+    tf-idf vector, in O(|doc|), instead of refetching
+    every feedback vector and recomputing both centroids at each round.
+    Sessions live in a `cache.Cache`: least recently used ones are evicted past the memory
+    budget, idle ones (neither read nor changed) expire after the time to live.
+"""
+import secrets
+import threading
+
+import cache
+import feedback
+
+# CONSTANTS
+TTL = 1800
+MAX_BYTES = 32 << 20
+
+RELEVANT = 'relevant'
+NON_RELEVANT = 'non_relevant'
+
+class Session:
+    """
+        Feedback session of the query `text` against `index`:
+            - `marks`: {`docID`->`RELEVANT` | `NON_RELEVANT`}.
+            - `sums`, `counts`: the sum {`term`->`weight`} and the number of the vectors of each kind.
+        `params` are the `feedback.truncate` and Rocchio weights (`alpha`, `beta`, `gamma`) of the
+        expansion, `k` & `candidates` & `rerank` the `index.Index.score` ones.
+        The vectors & sums are recomputed when the index `version` changes.
+    """
+
+    def __init__(
+            self,
+            index,
+            text : str,
+            k : int = -1,
+            candidates : int | None = None,
+            rerank : bool = True,
+            query_cache : cache.Cache | None = None,
+            **params
+        ):
+        self.text = text
+        self.k = k
+        self.candidates = candidates
+        self.rerank = rerank
+        self.params = {
+            'alpha' : feedback.ALPHA,
+            'beta' : feedback.BETA,
+            'gamma' : feedback.GAMMA,
+            'max_terms' : None,
+            'drop_negative' : False,
+            **params,
+        }
+        self.marks = {}
+        self.lock = threading.Lock()
+        self._query_cache = query_cache
+        self._reset(index)
+
+    def _reset(self, index) -> None:
+        """
+            Recomputes the query vector and the sums with the current weights of `index`.
+        """
+        self.version = index.version
+        self.vector = cache.query_vector(index, self.text, self._query_cache)
+        self.sums = {RELEVANT : {}, NON_RELEVANT : {}}
+        self.counts = {RELEVANT : 0, NON_RELEVANT : 0}
+        with index.lock:
+            for doc_id, kind in self.marks.items():
+                self._add(index, doc_id, kind, 1.)
+
+    def _add(self, index, doc_id : int, kind : str, sign : float) -> None:
+        if not (vec := index.document(doc_id)):
+            return      # unknown or empty documents do not count, as in `feedback.get_vectors`
+        total = self.sums[kind]
+        for t, w in vec.items():
+            total[t] = total.get(t, 0.) + sign * w
+        self.counts[kind] += int(sign)
+        if self.counts[kind] == 0:
+            total.clear()       # no rounding residue once every document is unmarked
+
+    def mark(self, index, doc_id : int, kind : str | None) -> None:
+        """
+            Marks `doc_id` as `RELEVANT`, `NON_RELEVANT` or, if `kind` is `None`, unmarks it.
+        """
+        if kind not in (RELEVANT, NON_RELEVANT, None):
+            raise ValueError(f'unknown feedback {kind}')
+        with self.lock:
+            if self.version != index.version:
+                self._reset(index)
+            with index.lock:
+                if (old := self.marks.pop(doc_id, None)) is not None:
+                    self._add(index, doc_id, old, -1.)
+                if kind is not None:
+                    self.marks[doc_id] = kind
+                    self._add(index, doc_id, kind, 1.)
+
+    def query(self, index) -> dict:
+        """
+            The Rocchio expansion of the query with the marked documents, as `feedback.rocchio`.
+        """
+        with self.lock:
+            if self.version != index.version:
+                self._reset(index)
+            p = self.params
+            q = {t : w * p['alpha'] for t, w in self.vector.items()}
+            for kind, coeff in ((RELEVANT, p['beta']), (NON_RELEVANT, -p['gamma'])):
+                if self.counts[kind]:
+                    scale = coeff / self.counts[kind]
+                    for t, w in self.sums[kind].items():
+                        q[t] = q.get(t, 0.) + w * scale
+        return feedback.truncate(q, p['max_terms'], p['drop_negative'])
+
+    def score(self, index, backend : str = 'postings') -> dict:
+        """
+            `index.score` of the expanded query.
+        """
+        return index.score(self.query(index), self.k, backend, self.candidates, self.rerank)
+
+    def state(self) -> dict:
+        with self.lock:
+            return {
+                'relevants' : [d for d, kind in self.marks.items() if kind == RELEVANT],
+                'non-relevants' : [d for d, kind in self.marks.items() if kind == NON_RELEVANT],
+                'k' : self.k,
+                'version' : self.version,
+            }
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sum(
+            cache.sizeof(x) for x in (self.text, self.params, self.marks, self.vector, self.sums)
+        )
+
+class SessionStore:
+    """
+        The sessions by id, in a `cache.Cache` of `max_bytes` with a `ttl` of inactivity.
+    """
+
+    def __init__(self, max_bytes : int = MAX_BYTES, ttl : float | None = TTL):
+        self.sessions = cache.Cache(max_bytes, ttl, sliding=True)
+
+    def create(self, session : Session) -> str | None:
+        """
+            Stores a new `session`, returns its id or `None` if it is larger than the whole budget.
+        """
+        session_id = secrets.token_urlsafe(16)
+        return session_id if self.sessions.put(session_id, session) else None
+
+    def get(self, session_id : str) -> Session | None:
+        """
+            The session `session_id`, if not expired: its ttl restarts.
+        """
+        return self.sessions.get(session_id)
+
+    def save(self, session_id : str, session : Session) -> bool:
+        """
+            Stores `session` again after a change: its size is recomputed & its ttl restarts.
+            Returns `False` if it outgrew the whole budget: it is dropped.
+        """
+        return self.sessions.put(session_id, session)
+
+    def delete(self, session_id : str) -> bool:
+        return self.sessions.delete(session_id)
+
+    def stats(self) -> dict:
+        return self.sessions.stats()
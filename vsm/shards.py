@@ -0,0 +1,206 @@
+"""
+    **Sharded** multi-process scoring of a `csr.CSRModel`.
+
+    The documents are split in `n_shards` contiguous ranges, the term-major matrix of
+    each range lives in `multiprocessing.shared_memory` blocks that one worker process
+    per shard maps once: a request only sends the query terms & weights to every worker,
+    each returns its local **top k** and the coordinator merges them with a heap.
+    Scores are accumulated in the same order of `csr.CSRModel.score`, so the results are
+    identical to the single process CSR backend.
+    Workers are started with 'spawn' (the coordinator can be a threaded server).
+"""
+import atexit
+import heapq
+import threading
+import multiprocessing as mp
+import numpy as np
+
+from multiprocessing import shared_memory
+
+import csr
+
+# CONSTANTS
+SHARDS = 4
+ARRAYS = ('indptr', 'indices', 'data', 'doc_ids')
+
+class ShardedScorer:
+    """
+        `n_shards` worker processes scoring the documents of a `csr.CSRModel`, see `load`.
+        Call `close` (or use it as a context manager) to stop the workers & free the memory.
+    """
+
+    def __init__(self, model : csr.CSRModel | None = None, n_shards : int = SHARDS):
+        self.n_shards = n_shards
+        self.model = None
+        self.version = None
+        self._blocks = []
+        self._lock = threading.Lock()
+
+        context = mp.get_context('spawn')     # no fork of the threads of a server
+        self._pipes = []
+        self._workers = []
+        for _ in range(n_shards):
+            parent, child = context.Pipe()
+            worker = context.Process(target=_worker, args=(child,), daemon=True)
+            worker.start()
+            child.close()
+            self._pipes.append(parent)
+            self._workers.append(worker)
+
+        atexit.register(self.close)
+        if model is not None:
+            self.load(model)
+
+    def __enter__(self) -> 'ShardedScorer':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def load(self, model : csr.CSRModel, version = None) -> None:
+        """
+            Shares the shards of `model` with the workers, replacing the previous ones.
+            `version` is only kept in `self.version` (e.g. `index.Index.version`).
+        """
+        N = len(model.doc_ids)
+        bounds = np.linspace(0, N, self.n_shards + 1).astype(np.int64)
+        blocks = []
+        specs = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            shard = model.matrix[lo:hi].T.tocsr()       # term-major, like `model.matrix_t`
+            arrays = {
+                'indptr' : shard.indptr.astype(np.int64),
+                'indices' : shard.indices.astype(np.int32),
+                'data' : shard.data,
+                'doc_ids' : model.doc_ids[lo:hi],
+            }
+            spec = {}
+            for name in ARRAYS:
+                a = arrays[name]
+                block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+                np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[:] = a
+                blocks.append(block)
+                spec[name] = (block.name, a.shape, a.dtype.str)
+            specs.append(spec)
+
+        with self._lock:
+            for pipe, spec in zip(self._pipes, specs):
+                pipe.send(('load', spec))
+            try:
+                self._receive()
+            except RuntimeError:
+                _free(blocks)
+                raise
+            old, self._blocks = self._blocks, blocks
+            self.model = model
+            self.version = version
+        _free(old)
+
+    def score(self, query : dict, k : int = -1) -> dict:
+        """
+            {`docID`->`score`} of `query` as `csr.CSRModel.rank(model.score(query), k)`.
+        """
+        with self._lock:
+            # the columns of the query must be the ones of the shards being scored
+            if self.model is None:
+                raise RuntimeError('no model loaded')
+            Q = self.model.query_matrix([query])
+            request = ('score', Q.indices, Q.data, k)
+            for pipe in self._pipes:
+                pipe.send(request)
+            results = self._receive()
+
+        if k == -1:
+            # every document, in docID order: shards are contiguous docID ranges
+            return {d : s for doc_ids, scores in results for d, s in zip(doc_ids, scores)}
+
+        # every shard is sorted by (-score, docID)
+        merged = heapq.merge(*[zip((-s for s in scores), doc_ids) for doc_ids, scores in results])
+        top = list(merged)[:k] if k < 0 else [x for _, x in zip(range(k), merged)]
+        return {d : -s for s, d in top}
+
+    def _receive(self) -> list:
+        """
+            The answer of every worker (all of them are read, to keep the pipes in step),
+            raises `RuntimeError` if any of them failed.
+        """
+        answers = [pipe.recv() for pipe in self._pipes]
+        if errors := [value for status, value in answers if status == 'error']:
+            raise RuntimeError(f'shard worker failed: {errors[0]}')
+        return [value for _, value in answers]
+
+    def close(self) -> None:
+        atexit.unregister(self.close)
+        with self._lock:
+            for pipe in self._pipes:
+                try:
+                    pipe.send(('close',))
+                except (OSError, BrokenPipeError):
+                    pass
+            for worker in self._workers:
+                worker.join(timeout=5)
+            self._pipes = []
+            self._workers = []
+            _free(self._blocks)
+            self._blocks = []
+
+
+def _free(blocks : list) -> None:
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def _worker(pipe) -> None:
+    """
+        Shard process: maps the arrays sent with 'load', answers each 'score' with its local top k.
+        Every answer is `('ok', result)`, or `('error', message)` if the request failed.
+    """
+    blocks = []
+    shard = None
+    while True:
+        message = pipe.recv()
+        if message[0] == 'close':
+            break
+        try:
+            if message[0] == 'load':
+                for block in blocks:
+                    block.close()
+                blocks, shard = [], None
+                blocks, shard = _map(message[1])
+                result = True
+            else:
+                result = _top_k(shard, *message[1:])
+        except Exception as e:
+            pipe.send(('error', f'{type(e).__name__}: {e}'))
+        else:
+            pipe.send(('ok', result))
+
+    for block in blocks:
+        block.close()
+
+def _map(spec : dict) -> tuple[list, dict]:
+    """
+        The shared memory blocks of the arrays in `spec` and the arrays mapped on them.
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in spec.values()]
+    shard = {
+        name : np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        for (name, (_, shape, dtype)), block in zip(spec.items(), blocks)
+    }
+    return blocks, shard
+
+def _top_k(shard : dict, cols : np.ndarray, weights : np.ndarray, k : int) -> tuple[list, list]:
+    """
+        The docIDs and scores of the local top `k` of the query (`cols`, `weights`).
+    """
+    if shard is None:
+        raise RuntimeError('no shard loaded')
+    indptr, indices, data, doc_ids = (shard[name] for name in ARRAYS)
+    scores = np.zeros(len(doc_ids), dtype=data.dtype)
+    for col, w in zip(cols.tolist(), weights.tolist()):
+        lo, hi = indptr[col], indptr[col + 1]
+        scores[indices[lo:hi]] += w * data[lo:hi]
+
+    # k < -1 drops the last documents of the merged ranking: every shard sends all of its own
+    order = csr.top_order(doc_ids, scores, len(scores) if k < -1 else k)
+    return doc_ids[order].tolist(), scores[order].tolist()
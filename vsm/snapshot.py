@@ -0,0 +1,456 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+import vsm
+import csr
+import index
+import compressed
+
+# CONSTANTS
+SNAPSHOT_FILE = 'series_data.idx'
+MAGIC = b'VSMSNAP\0'
+VERSION = 4
+ALIGN = 64
+CHUNK_SIZE = 1 << 12
+
+class Snapshot:
+    """
+        Read only, **memory mapped** view of a processed collection.
+        Arrays:
+            - `terms`, `term_offsets`: the vocabulary as an utf-8 blob and the offsets of each term.
+            - `df_counts`: the document frequency of each term.
+            - `doc_ids`, `doc_indptr`, `doc_terms`, `doc_weights`: the **tf-idf** vectors of the documents
+              (CSR), sorted by docID.
+            - `doc_tf`: the **tf** of the same entries, to recompute the weights when the idf changes.
+            - `doc_norms`: the euclidean norm of each document vector.
+            - `row_ids`, `row_indptr`, `row_terms`, `row_weights`: the **L2-normalised** vectors of the
+              non empty documents, and `col_indptr`, `col_rows`, `col_weights` the same matrix term-major:
+              the arrays of `csr_model`.
+            - `gaps`, `gap_offsets`, `impacts`, `scales`: the `compressed.CompressedPostings` of the
+              same term-major postings (offsets `col_indptr`), see `compressed_postings`.
+        The same pages are shared by every process mapping the same file.
+    """
+
+    def __init__(self, header : dict, arrays : dict):
+        self.header = header
+        self.collection_size = header['collection_size']
+        self._columns = None
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+
+    def vocabulary(self) -> list[str]:
+        """
+            The terms, in column order.
+        """
+        raw = self.terms.tobytes()
+        offsets = self.term_offsets.tolist()
+        return [raw[offsets[i]:offsets[i + 1]].decode('utf8') for i in range(len(offsets) - 1)]
+
+    def df(self) -> dict:
+        """
+            The {`term`->`df`} map, as `vsm.compute_df`.
+        """
+        return dict(zip(self.vocabulary(), self.df_counts.tolist()))
+
+    def tf_idf(self) -> dict:
+        """
+            The {`docID`->{`term`->`tf-idf`}} map, as `vsm.compute_tfidf`.
+        """
+        vocabulary = self.vocabulary()
+        indptr = self.doc_indptr.tolist()
+        terms = self.doc_terms.tolist()
+        weights = self.doc_weights.tolist()
+        return {
+            doc_id : {vocabulary[terms[j]] : weights[j] for j in range(indptr[i], indptr[i + 1])}
+            for i, doc_id in enumerate(self.doc_ids.tolist())
+        }
+
+    def tf(self) -> dict:
+        """
+            The {`docID`->{`term`->`tf`}} map, as `index.term_frequencies`.
+        """
+        vocabulary = self.vocabulary()
+        indptr = self.doc_indptr.tolist()
+        terms = self.doc_terms.tolist()
+        tf = self.doc_tf.tolist()
+        return {
+            doc_id : {vocabulary[terms[j]] : tf[j] for j in range(indptr[i], indptr[i + 1])}
+            for i, doc_id in enumerate(self.doc_ids.tolist())
+        }
+
+    def columns(self) -> dict:
+        """
+            The {`term`->`term id`} map, built once.
+        """
+        if self._columns is None:
+            self._columns = {t : i for i, t in enumerate(self.vocabulary())}
+        return self._columns
+
+    def csr_model(self) -> csr.CSRModel:
+        """
+            The `csr.CSRModel` of the snapshot over its mapped arrays, columns are the term ids.
+        """
+        return csr.CSRModel.from_arrays(
+            self.row_ids,
+            self.columns(),
+            (self.row_weights, self.row_terms, self.row_indptr),
+            (self.col_weights, self.col_rows, self.col_indptr),
+        )
+
+    def compressed_postings(self) -> compressed.CompressedPostings:
+        """
+            The `compressed.CompressedPostings` of the snapshot over its mapped arrays
+            (the float weights are not read).
+        """
+        return compressed.CompressedPostings.from_arrays(
+            self.row_ids, self.columns(), self.col_indptr, self.gaps, self.gap_offsets, self.impacts, self.scales
+        )
+
+    def norms(self) -> dict:
+        """
+            The {`docID`->`norm`} map of the non empty documents, as `vsm.compute_norms`.
+        """
+        empty = np.diff(self.doc_indptr) == 0
+        return {
+            doc_id : norm for doc_id, norm, e in
+            zip(self.doc_ids.tolist(), self.doc_norms.tolist(), empty.tolist()) if not e
+        }
+
+
+def checksum(path : str) -> str:
+    """
+        sha256 of the source collection.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def build(
+        path : str = SNAPSHOT_FILE,
+        source : str | None = None,
+        log : bool = False,
+        workers : int | None = 1,
+        progress = None
+    ) -> Snapshot:
+    """
+        Processes the collection `source` (default `vsm.JSON_FILE`, JSON or JSON Lines) and writes
+        its snapshot in `path`, in two passes with flat memory:
+            1. each batch is tokenized, its term ids & tf are appended to temporary files
+               and the df of its terms counted: only the vocabulary stays in memory.
+            2. the idf weights, norms and term-major postings are computed `CHUNK_SIZE`
+               documents at a time from the mapped temporary files, into the snapshot.
+        `progress(**changes)`, if given, is called with the `documents` processed after each
+        batch and with `state='writing'` before the second pass.
+    """
+    source = source or vsm.JSON_FILE
+    digest = checksum(source)
+    vocabulary = {}
+    df = []
+    with Spool(os.path.dirname(os.path.abspath(path))) as spool:
+        for batch in vsm.iter_processed_data(log=log, path=source, workers=workers):
+            for d in batch:
+                tokens = d['title_tokens'] + d['overview_tokens']
+                for t in dict.fromkeys(tokens):     # same term order of `vsm.compute_df`
+                    if (i := vocabulary.setdefault(sys.intern(t), len(df))) == len(df):
+                        df.append(0)
+                    df[i] += 1
+                tf = index.term_frequencies(tokens)
+                spool.add(d['docID'], [vocabulary[t] for t in tf], list(tf.values()))
+            spool.flush()
+            if progress is not None:
+                progress(documents=spool.size)
+
+        if progress is not None:
+            progress(state='writing')
+        assemble(path, digest, list(vocabulary), np.array(df, dtype=np.int64), spool.arrays())
+    if log:
+        print(f'{vsm.GREEN}[DONE]{vsm.END}\tSnapshot written in {path}.')
+    return load(path, source)
+
+def write(path : str, idx : index.Index, digest : str) -> None:
+    """
+        Writes the snapshot of the index `idx` in `path`, atomically: its term frequencies are
+        spooled (holding its lock) and weighted with the current df, as `build` does.
+    """
+    with Spool(os.path.dirname(os.path.abspath(path))) as spool:
+        with idx.lock:
+            if idx.stale:
+                idx.refresh()
+            terms = list(idx.df)
+            df = np.array(list(idx.df.values()), dtype=np.int64)
+            vocabulary = {t : i for i, t in enumerate(terms)}
+            for doc_id, tf in idx.tf.items():
+                spool.add(doc_id, [vocabulary[t] for t in tf], list(tf.values()))
+        assemble(path, digest, terms, df, spool.arrays())
+
+class Spool:
+    """
+        Temporary files, in `directory`, of the documents of the first pass: their docID,
+        number of terms, term ids and tf. `add` buffers a document, `flush` appends the buffers.
+    """
+    DTYPES = {'doc_ids' : np.int64, 'lengths' : np.int64, 'terms' : np.int32, 'tf' : np.float64}
+
+    def __init__(self, directory : str):
+        self.tmp = tempfile.TemporaryDirectory(prefix='.snapshot-', dir=directory)
+        self.files = {name : open(os.path.join(self.tmp.name, name), 'wb') for name in self.DTYPES}
+        self.buffers = {name : [] for name in self.DTYPES}
+        self.size = 0
+
+    def __enter__(self) -> 'Spool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for f in self.files.values():
+            f.close()
+        self.tmp.cleanup()
+
+    def add(self, doc_id : int, terms : list[int], tf : list[float]) -> None:
+        self.buffers['doc_ids'].append(doc_id)
+        self.buffers['lengths'].append(len(terms))
+        self.buffers['terms'] += terms
+        self.buffers['tf'] += tf
+        self.size += 1
+
+    def flush(self) -> None:
+        for name, dtype in self.DTYPES.items():
+            np.array(self.buffers[name], dtype=dtype).tofile(self.files[name])
+            self.buffers[name] = []
+
+    def arrays(self) -> dict:
+        """
+            The spooled arrays, memory mapped.
+        """
+        self.flush()
+        arrays = {}
+        for name, dtype in self.DTYPES.items():
+            self.files[name].close()
+            size = os.path.getsize(self.files[name].name)
+            arrays[name] = np.memmap(self.files[name].name, dtype=dtype, mode='r') if size else np.zeros(0, dtype=dtype)
+        return arrays
+
+def assemble(path : str, digest : str, terms : list[str], df : np.ndarray, spooled : dict) -> None:
+    """
+        Second pass: writes in `path` (atomically) the snapshot of the `spooled` documents,
+        with the vocabulary `terms` and their `df`. The arrays are filled `CHUNK_SIZE`
+        documents at a time, in docID order:
+            - the tf-idf weights, their norms and the L2-normalised rows.
+            - the term-major postings, with a counting sort: the offsets of each term are
+              known from `df` and each chunk is placed after the previous ones.
+            - the `compressed.CompressedPostings` of the same postings, whose sizes and
+              scales are found by a first sweep over the chunks.
+    """
+    order = np.argsort(spooled['doc_ids'], kind='stable')
+    doc_ids = np.asarray(spooled['doc_ids'])[order]
+    if len(doc_ids) > 1 and (np.diff(doc_ids) == 0).any():
+        raise ValueError('duplicated docIDs in the collection')
+    src_lengths = np.asarray(spooled['lengths'])
+    src_indptr = np.concatenate([[0], np.cumsum(src_lengths)]).astype(np.int64)
+    lengths = src_lengths[order]
+    doc_indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    nonempty = lengths > 0
+    rows = np.cumsum(nonempty) - 1        # row of each document in the normalised matrix
+    N, V, nnz, R = len(doc_ids), len(terms), int(doc_indptr[-1]), int(nonempty.sum())
+    if int(df.sum()) != nnz:
+        raise ValueError('df does not match the documents')
+    idf = np.log((N + 1) / (df + 1))
+
+    def chunks():
+        """
+            The entries of `CHUNK_SIZE` documents at a time, gathered from the spool in docID order,
+            with their weights and their order by term (stable: rows stay sorted inside each term).
+        """
+        for lo in range(0, N, CHUNK_SIZE):
+            hi = min(lo + CHUNK_SIZE, N)
+            counts = lengths[lo:hi]
+            begin, end = doc_indptr[lo], doc_indptr[hi]
+            src = np.repeat(src_indptr[order[lo:hi]] - (doc_indptr[lo:hi] - begin), counts) + np.arange(end - begin)
+            term_ids = np.asarray(spooled['terms'])[src]
+            tf = np.asarray(spooled['tf'])[src]
+            weights = tf * idf[term_ids]
+
+            norms = np.zeros(hi - lo)
+            starts = (doc_indptr[lo:hi] - begin)[nonempty[lo:hi]]
+            if len(starts):
+                norms[nonempty[lo:hi]] = np.sqrt(np.add.reduceat(weights ** 2, starts))
+            normalised = weights / np.repeat(np.where(norms > 0, norms, 1), counts)
+
+            by_term = np.argsort(term_ids, kind='stable')
+            sorted_terms = term_ids[by_term]
+            present, first, sizes = np.unique(sorted_terms, return_index=True, return_counts=True)
+            yield {
+                'lo' : lo, 'hi' : hi, 'begin' : begin, 'end' : end,
+                'term_ids' : term_ids, 'tf' : tf, 'weights' : weights, 'norms' : norms, 'normalised' : normalised,
+                'by_term' : by_term, 'sorted_terms' : sorted_terms, 'present' : present, 'first' : first, 'sizes' : sizes,
+                'sorted_rows' : np.repeat(rows[lo:hi], counts)[by_term],
+            }
+
+    def gaps(c : dict, last : np.ndarray) -> np.ndarray:
+        """
+            The row gaps of the entries of the chunk `c` in term order, `last` is the last row of each term.
+        """
+        previous = np.concatenate([[0], c['sorted_rows'][:-1]])
+        previous[c['first']] = last[c['present']]
+        last[c['present']] = c['sorted_rows'][c['first'] + c['sizes'] - 1]
+        return c['sorted_rows'] - previous
+
+    # first sweep: bytes of the varint gaps and largest normalised weight of each term
+    gap_bytes = np.zeros(V, dtype=np.int64)
+    maxima = np.zeros(V, dtype=np.float64)
+    last = np.zeros(V, dtype=np.int64)
+    for c in chunks():
+        np.add.at(gap_bytes, c['sorted_terms'], compressed.varint_lengths(gaps(c, last)))
+        np.maximum.at(maxima, c['term_ids'], c['normalised'])
+    gap_offsets = np.concatenate([[0], np.cumsum(gap_bytes)])
+    scales = compressed.scales_of(maxima)
+
+    encoded = [t.encode('utf8') for t in terms]
+    index_type = np.int32 if max(nnz, V, R) < 2 ** 31 else np.int64
+    shapes = {
+        'terms' : (np.uint8, sum(len(t) for t in encoded)),
+        'term_offsets' : (np.int64, V + 1),
+        'df_counts' : (np.int64, V),
+        'doc_ids' : (np.int64, N),
+        'doc_indptr' : (np.int64, N + 1),
+        'doc_terms' : (np.int32, nnz),
+        'doc_weights' : (np.float64, nnz),
+        'doc_tf' : (np.float64, nnz),
+        'doc_norms' : (np.float64, N),
+        'row_ids' : (np.int64, R),
+        'row_indptr' : (index_type, R + 1),
+        'row_terms' : (index_type, nnz),
+        'row_weights' : (np.float64, nnz),
+        'col_indptr' : (index_type, V + 1),
+        'col_rows' : (index_type, nnz),
+        'col_weights' : (np.float64, nnz),
+        'gaps' : (np.uint8, int(gap_offsets[-1])),
+        'gap_offsets' : (np.int64, V + 1),
+        'impacts' : (compressed.IMPACT_TYPES[compressed.BITS], nnz),
+        'scales' : (np.float32, V),
+    }
+
+    layout = {}
+    offset = 0
+    for name, (dtype, size) in shapes.items():
+        layout[name] = {'dtype' : np.dtype(dtype).str, 'shape' : [size], 'offset' : offset}
+        offset += -(-size * np.dtype(dtype).itemsize // ALIGN) * ALIGN
+
+    header = json.dumps({
+        'version' : VERSION,
+        'checksum' : digest,
+        'collection_size' : N,
+        'arrays' : layout,
+    }).encode('utf8')
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    tmp = f'{path}.tmp.{os.getpid()}'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.array([VERSION, len(header)], dtype='<u4').tobytes())
+            f.write(header)
+            f.truncate(start + offset)
+
+        buffer = np.memmap(tmp, dtype=np.uint8, mode='r+')
+        out = {
+            name : buffer[start + spec['offset']:][:size * np.dtype(dtype).itemsize].view(dtype)
+            for (name, (dtype, size)), spec in zip(shapes.items(), layout.values())
+        }
+        out['terms'][:] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        out['term_offsets'][:] = np.cumsum([0] + [len(t) for t in encoded])
+        out['df_counts'][:] = df
+        out['doc_ids'][:] = doc_ids
+        out['doc_indptr'][:] = doc_indptr
+        out['row_ids'][:] = doc_ids[nonempty]
+        out['row_indptr'][:] = np.concatenate([[0], np.cumsum(lengths[nonempty])])
+        out['col_indptr'][:] = np.concatenate([[0], np.cumsum(df)])
+        out['gap_offsets'][:] = gap_offsets
+        out['scales'][:] = scales
+
+        # second sweep: every array, each chunk of postings after the previous ones of its terms
+        cursor = np.asarray(out['col_indptr'][:-1], dtype=np.int64)
+        gap_cursor = gap_offsets[:-1].copy()
+        last[:] = 0
+        for c in chunks():
+            begin, end, lo, hi = c['begin'], c['end'], c['lo'], c['hi']
+            out['doc_terms'][begin:end] = c['term_ids']
+            out['doc_tf'][begin:end] = c['tf']
+            out['doc_weights'][begin:end] = c['weights']
+            out['doc_norms'][lo:hi] = c['norms']
+            out['row_terms'][begin:end] = c['term_ids']
+            out['row_weights'][begin:end] = c['normalised']
+
+            sorted_terms, first, sizes = c['sorted_terms'], c['first'], c['sizes']
+            rank = np.arange(len(sorted_terms)) - np.repeat(first, sizes)      # inside the term, in the chunk
+            positions = cursor[sorted_terms] + rank
+            weights = c['normalised'][c['by_term']]
+            out['col_rows'][positions] = c['sorted_rows']
+            out['col_weights'][positions] = weights
+            out['impacts'][positions] = compressed.quantise_impacts(weights, scales[sorted_terms])
+            cursor[c['present']] += sizes
+
+            data, byte_lengths = compressed.encode_varint(gaps(c, last))
+            ends = np.cumsum(byte_lengths)
+            term_start = np.repeat(ends[first + sizes - 1] - np.add.reduceat(byte_lengths, first), sizes) if len(first) else ends
+            destinations = gap_cursor[sorted_terms] + ends - byte_lengths - term_start
+            out['gaps'][np.repeat(destinations - (ends - byte_lengths), byte_lengths) + np.arange(len(data))] = data
+            if len(first):
+                gap_cursor[c['present']] += np.add.reduceat(byte_lengths, first)
+
+        buffer.flush()
+        del out, buffer
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):      # the second pass failed
+            os.remove(tmp)
+
+def load(path : str = SNAPSHOT_FILE, source : str | None = None, check : bool = True) -> Snapshot | None:
+    """
+        Memory maps the snapshot in `path`.
+        Returns `None` if it is missing, it has another format version or,
+        when `check` is set, it was not built from the current `source` (default `vsm.JSON_FILE`).
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        version, size = np.frombuffer(f.read(8), dtype='<u4').tolist()
+        if version != VERSION:
+            return None
+        header = json.loads(f.read(size))
+
+    if check and header['checksum'] != checksum(source or vsm.JSON_FILE):
+        return None
+
+    start = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        # plain arrays on the mapped buffer: slicing a `np.memmap` is several times slower
+        arrays[name] = np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=buffer, offset=start + spec['offset'])
+
+    return Snapshot(header, arrays)
+
+def load_or_build(path : str = SNAPSHOT_FILE, source : str | None = None, log : bool = False) -> Snapshot:
+    """
+        Loads the snapshot in `path`, (re)building it if missing or outdated.
+    """
+    if (snapshot := load(path, source)) is not None:
+        if log:
+            print(f'{vsm.GREEN}[LOAD]{vsm.END}\tSnapshot {path} loaded.')
+        return snapshot
+
+    if log:
+        print(f'{vsm.PURPLE}[WARNING]{vsm.END}\tSnapshot {path} missing or outdated, rebuilding.')
+    return build(path, source, log)
+
+
+if __name__ == '__main__':
+    build(log=True, workers=None)
@@ -0,0 +1,115 @@
+import sys
+import numpy as np
+
+class Vocabulary:
+    """
+        Append only map {`term`<->`id`}, term strings are interned once here
+        instead of being copied in each vector. The initial `terms` must be distinct.
+    """
+
+    def __init__(self, terms : list[str] = ()):
+        self.terms = list(map(sys.intern, terms))
+        self.ids = {t : i for i, t in enumerate(self.terms)}
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def id(self, term : str, add : bool = True) -> int | None:
+        """
+            The id of `term`, a new one if missing and `add` (otherwise `None`).
+        """
+        if (i := self.ids.get(term)) is None and add:
+            term = sys.intern(term)
+            i = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return i
+
+class SparseVector:
+    """
+        Compact **sparse** vector: sorted, unique int32 term ids and their float32 weights.
+        Arithmetic merges the sorted id arrays, `from_dict` & `to_dict` convert it
+        from & to the {`term`->`weight`} form with a `Vocabulary`.
+    """
+    __slots__ = ('ids', 'weights')
+
+    def __init__(self, ids = (), weights = ()):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+    @classmethod
+    def from_dict(cls, vec : dict, vocabulary : Vocabulary, add : bool = False) -> 'SparseVector':
+        """
+            Vector of {`term`->`weight`}, terms out of `vocabulary` are dropped unless `add`.
+        """
+        ids = []
+        weights = []
+        for t, w in vec.items():
+            if (i := vocabulary.id(t, add)) is not None:
+                ids.append(i)
+                weights.append(w)
+        ids = np.array(ids, dtype=np.int32)
+        if len(ids) == 0:
+            return cls()
+        order = np.argsort(ids)
+        return cls(ids[order], np.array(weights, dtype=np.float32)[order])
+
+    def to_dict(self, vocabulary : Vocabulary) -> dict:
+        terms = vocabulary.terms
+        return dict(zip(map(terms.__getitem__, self.ids.tolist()), self.weights.tolist()))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __repr__(self) -> str:
+        return f'SparseVector({self.ids.tolist()}, {self.weights.tolist()})'
+
+    # ARITHMETIC
+    def __add__(self, other : 'SparseVector') -> 'SparseVector':
+        return combine([self, other], [1., 1.])
+
+    def __sub__(self, other : 'SparseVector') -> 'SparseVector':
+        return combine([self, other], [1., -1.])
+
+    def __mul__(self, t : int | float) -> 'SparseVector':
+        return SparseVector(self.ids, self.weights * np.float32(t))
+
+    __rmul__ = __mul__
+
+    def dot(self, other : 'SparseVector') -> float:
+        _, i, j = np.intersect1d(self.ids, other.ids, assume_unique=True, return_indices=True)
+        return float(np.dot(self.weights[i].astype(np.float64), other.weights[j]))
+
+    def norm(self) -> float:
+        return float(np.sqrt(np.dot(self.weights.astype(np.float64), self.weights)))
+
+
+def merge(ids : np.ndarray, weights : np.ndarray) -> SparseVector:
+    """
+        **Sparse** vector of the (`ids`, `weights`) entries, in any order:
+        the weights of repeated ids are summed.
+    """
+    if len(ids) == 0:
+        return SparseVector()
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    first = np.empty(len(ids), dtype=bool)
+    first[0] = True
+    np.not_equal(ids[1:], ids[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    return SparseVector(ids[starts], np.add.reduceat(weights[order], starts))
+
+def combine(vectors : list[SparseVector], coeffs : list[float]) -> SparseVector:
+    """
+        **Sparse** linear combination `sum(c * v)` with a single merge of all the id arrays.
+    """
+    if not vectors:
+        return SparseVector()
+    ids = np.concatenate([v.ids for v in vectors])
+    weights = np.concatenate([v.weights for v in vectors]) * np.repeat(coeffs, [len(v.ids) for v in vectors])
+    return merge(ids, weights)
+
+def mean(vectors : list[SparseVector]) -> SparseVector:
+    """
+        **Sparse** mean vector.
+    """
+    return combine(vectors, [1 / len(vectors)] * len(vectors)) if vectors else SparseVector()
@@ -1,15 +1,30 @@
+import os
 import json
+import time
+import heapq
 import numpy as np
+import scipy.sparse as sp
+
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from nltk.stem import PorterStemmer
-from collections import Counter
+from collections import Counter, deque
+
+import metrics
 
 # CONSTANTS
 JSON_FILE = 'series_data.json'
 TITLE = 'Series_Title'
 OVERVIEW = 'Overview'
+PUNCTUATION = '!"#$%&()*+-./:;<=>?@[]\\^_~`{}|\n£°,'
+STEM_CACHE_SIZE = 1 << 16
+CHUNK_SIZE = 256
+BLOCK_SIZE = 1024
+TOP_K_MAX_TERMS = 16      # longer queries (e.g. Rocchio expansions) are ranked faster exhaustively
 
 # COLOR FOR LOGGING
 RED='\033[0;31m'
@@ -19,39 +34,127 @@ CYAN='\033[0;36m'
 END='\033[0m'
 
 # PROCESS DATA
-def load_data() -> list[dict]:
+def load_data(path : str | None = None) -> list[dict]:
+    """
+        Loads the dataset (default `JSON_FILE`) as a list of dictionaries,
+        from a JSON array or a **JSON Lines** (`.jsonl`) file.
+    """
+    return [d for batch in iter_data(path) for d in batch]
+
+def iter_data(path : str | None = None, batch_size : int = CHUNK_SIZE):
     """
-        Loads the dataset as a list of dictionaries.
+        Yields the dataset (default `JSON_FILE`) as lists of (at most) `batch_size` dictionaries,
+        reading it incrementally: a `.jsonl` file line by line, a JSON array one object at a time.
     """
-    with open(JSON_FILE, 'r', encoding='utf8') as f:
-        return json.load(f)
+    path = path or JSON_FILE
+    with open(path, 'r', encoding='utf8') as f:
+        if path.endswith('.jsonl'):
+            docs = (json.loads(line) for line in f if line.strip())
+        else:
+            docs = _iter_json_array(f)
+        while batch := list(islice(docs, batch_size)):
+            yield batch
+
+def _iter_json_array(f, read_size : int = 1 << 16):
+    """
+        Yields the items of the JSON array in the file `f`, keeping only a few blocks in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    opened = False
+    while True:
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if not opened and pos < len(buffer):
+                if buffer[pos] != '[':
+                    raise ValueError('the dataset is not a JSON array')
+                opened = True
+                pos += 1
+                continue
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break       # incomplete item: read more
+            yield item
+        block = f.read(read_size)
+        if not block:
+            if buffer[pos:].strip():
+                raise ValueError('truncated JSON array')
+            return
+        buffer = buffer[pos:] + block
+
+def iter_processed_data(
+        log=False,
+        path : str | None = None,
+        workers : int | None = 1,
+        chunk_size : int = CHUNK_SIZE
+    ):
+    """
+        Yields the **processed** dataset in batches of `chunk_size` documents, as `load_processed_data`.
+        The dataset is read incrementally (see `iter_data`) and with `workers` > 1 (or `None`)
+        at most two batches per worker are processed at the same time: the memory used does
+        not depend on the size of the collection.
+    """
+    pool = ProcessPoolExecutor(workers) if workers is None or workers > 1 else None
+    ahead = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+
+    start = time.perf_counter()
+    c = 0
+    try:
+        batches = iter_data(path, chunk_size)
+        while True:
+            while pool and len(pending) < ahead and (batch := next(batches, None)) is not None:
+                pending.append((batch, pool.submit(_tokenize_chunk, [(d[TITLE], d[OVERVIEW]) for d in batch])))
+            if pool:
+                if not pending:
+                    break
+                batch, future = pending.popleft()
+                tokens = future.result()
+            else:
+                if (batch := next(batches, None)) is None:
+                    break
+                tokens = _tokenize_chunk([(d[TITLE], d[OVERVIEW]) for d in batch])
+
+            for d, (title_tokens, overview_tokens) in zip(batch, tokens):
+                d['title_tokens'] = title_tokens
+                d['overview_tokens'] = overview_tokens
+            c += len(batch)
+            if log:
+                rate = c / max(time.perf_counter() - start, 1e-9)
+                print(f'{CYAN}[LOAD]{END}\t{c} document processed ({rate:.0f} docs/sec).')
+            yield batch
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
 
-def load_processed_data(log=False) -> list[dict]:
+    if log:
+        print(f'{GREEN}[DONE]{END}')
+
+def load_processed_data(
+        log=False,
+        path : str | None = None,
+        workers : int | None = 1,
+        chunk_size : int = CHUNK_SIZE
+    ) -> list[dict]:
     """
         Loads & Process the dataset as a list of dictionaries.
         It adds this extra field in datas:
             - `id`: an unique integer identifier.
             - `title_tokens`: a list of title's **processed** tokens.
             - `overview_tokens`: a list of overview's **processed** tokens.
+        With `workers` > 1 (or `None`, i.e. all the cores) chunks of `chunk_size` documents are
+        processed by a pool of processes, the documents keep their order.
+        See `iter_processed_data` to process the collection one batch at a time.
     """
-    data = load_data()
+    return [d for batch in iter_processed_data(log, path, workers, chunk_size) for d in batch]
 
-    N = len(data)
-    c = 0
-    for d in data:
-        title_tokens = word_tokenize(str(preprocess(d[TITLE])))
-        overview_tokens = word_tokenize(str(preprocess(d[OVERVIEW])))
-        d['title_tokens'] = title_tokens 
-        d['overview_tokens'] = overview_tokens
-        
-        c += 1
-        if log and c % 100 == 0:
-            print(f'{CYAN}[LOAD]{END}\t{c} of {N} document processed.')
-    
-    if log:
-        print(f'{GREEN}[DONE]{END}')
-
-    return data
+def _tokenize_chunk(chunk : list[tuple]) -> list[tuple]:
+    return [(tokenize(title), tokenize(overview)) for title, overview in chunk]
 
 
 def compute_df(data : list[dict]) -> dict:
@@ -60,16 +163,9 @@ def compute_df(data : list[dict]) -> dict:
         The structure of the map is {`term`->`df`}.
     """
     DF = {}
-    N = len(data)
-    for i in range(N):
-        tokens = data[i]['title_tokens'] + data[i]['overview_tokens']
-        for w in tokens:
-            s = DF.get(w, set())
-            s.add(i)
-            DF[w] = s
-
-    for k in DF.keys():
-        DF[k] = len(DF[k])
+    for d in data:
+        for w in dict.fromkeys(d['title_tokens'] + d['overview_tokens']):
+            DF[w] = DF.get(w, 0) + 1
 
     return DF
 
@@ -96,24 +192,90 @@ def compute_tfidf(data : list[dict], DF : dict | None = None) -> dict:
             vec[t] = tf * idf
     return TF_IDF
 
+def compute_postings(TF_IDF : dict) -> dict:
+    """
+        Computes the **inverted index** of the **tf-idf** representation `TF_IDF`.
+        The structure of the map is {`term`->[(`docID`, `tf-idf`), ...]},
+        each posting list is sorted by docID.
+    """
+    POSTINGS = {}
+    for doc_id in sorted(TF_IDF):
+        for term, w in TF_IDF[doc_id].items():
+            POSTINGS.setdefault(term, []).append((doc_id, w))
+    return POSTINGS
+
+def compute_norms(TF_IDF : dict) -> dict:
+    """
+        Computes the euclidean norm of each (non empty) document vector.
+        The structure of the map is {`docID`->`norm`}.
+    """
+    return {
+        doc_id : float(np.linalg.norm(list(vec.values())))
+        for doc_id, vec in TF_IDF.items() if vec
+    }
+
+def compute_max_weights(POSTINGS : dict, NORMS : dict) -> dict:
+    """
+        Computes, for each term, the maximum **normalised** weight over its posting list
+        and the document having it.
+        The structure of the map is {`term`->(`max(tf-idf / norm)`, `docID`)}, it is the
+        per term upper bound used by `top_k` to skip documents.
+    """
+    return {
+        t : max(((w / NORMS[doc_id] if NORMS[doc_id] else 0., doc_id) for doc_id, w in postings), default=(0., None))
+        for t, postings in POSTINGS.items()
+    }
+
 # VECTOR SPACE MODEL
-def vector_space(data : list[dict]) -> np.ndarray:
+def vector_space(data : list[dict], dtype = np.float64, sparse : bool = False) -> np.ndarray | sp.csr_matrix:
     """
-        Returns a **dense** matrix with all TF_IDF vector.
+        Returns a **dense** (or **sparse** CSR, if `sparse`) matrix with all TF_IDF vector,
+        the row of a document is its docID, the columns follow the vocabulary order.
+    """
+    rows, cols, values, shape = _tfidf_entries(data)
+
+    if sparse:
+        return sp.csr_matrix((values.astype(dtype), (rows, cols)), shape=shape)
+
+    M = np.zeros(shape, dtype=dtype)
+    M[rows, cols] = values
+    return M
+
+def vector_space_blocks(
+        data : list[dict],
+        block_size : int = BLOCK_SIZE,
+        dtype = np.float64,
+        start : int = 0,
+        stop : int | None = None
+    ):
+    """
+        Yields the rows `start`...`stop` of the **dense** `vector_space(data)`,
+        as (`first_row`, `block`) pairs of at most `block_size` rows.
+    """
+    rows, cols, values, (N, V) = _tfidf_entries(data)
+    stop = N if stop is None else min(stop, N)
+
+    bounds = np.searchsorted(rows, np.arange(start, stop + block_size, block_size).clip(max=stop))
+    for i, first in enumerate(range(start, stop, block_size)):
+        lo, hi = bounds[i], bounds[i + 1]
+        block = np.zeros((min(block_size, stop - first), V), dtype=dtype)
+        block[rows[lo:hi] - first, cols[lo:hi]] = values[lo:hi]
+        yield first, block
+
+def _tfidf_entries(data : list[dict]) -> tuple:
+    """
+        Non zero entries (`rows`, `cols`, `values`) of the TF_IDF matrix, sorted by row, and its shape.
     """
     DF = compute_df(data)
-    VOCABULARY = list(DF.keys())
+    VOCABULARY = {term : i for i, term in enumerate(DF)}
     TF_IDF = compute_tfidf(data, DF)
 
-    N = len(data)
-    M = np.zeros((N, len(VOCABULARY)))
-    
-    for doc_id in TF_IDF:
-        for term in TF_IDF[doc_id]:
-            ind = VOCABULARY.index(term)
-            M[doc_id][ind] = TF_IDF[doc_id][term]
-    
-    return M
+    rows = np.fromiter((doc_id for doc_id, vec in TF_IDF.items() for _ in vec), dtype=np.int64)
+    cols = np.fromiter((VOCABULARY[t] for vec in TF_IDF.values() for t in vec), dtype=np.int64, count=len(rows))
+    values = np.fromiter((w for vec in TF_IDF.values() for w in vec.values()), dtype=np.float64, count=len(rows))
+
+    order = np.argsort(rows, kind='stable')
+    return rows[order], cols[order], values[order], (len(data), len(VOCABULARY))
 
 def query2vec(query : str | np.ndarray, DF : dict | None = None, collection_size : int | float = 2000) -> dict:
     """
@@ -128,7 +290,8 @@ def query2vec(query : str | np.ndarray, DF : dict | None = None, collection_size
         print(f"{GREEN}[DONE]{END}\tDocs frequency computed.")
         collection_size = len(data)
 
-    tokens = word_tokenize(str(preprocess(query)))
+    with metrics.stage('preprocess'):
+        tokens = tokenize(query)
     VEC = {}
     counter = Counter(tokens)
     for t in np.unique(tokens):     # rappresentazione sparsa
@@ -158,6 +321,111 @@ def cosine_similarity(a, b) -> float:
     else:
         return 0
 
+def score(query : dict, POSTINGS : dict, NORMS : dict) -> dict:
+    """
+        **Term at a time** cosine similarity between `query` and every document of the collection.
+        Only the posting lists of the query terms are visited, documents not sharing
+        any term with the query are **not** in the returned map {`docID`->`score`}.
+    """
+    norm_q = float(np.linalg.norm(list(query.values()))) if query else 0.
+    if norm_q == 0:
+        return {}
+
+    acc = {}
+    for t, w in query.items():
+        for doc_id, d in POSTINGS.get(t, ()):
+            acc[doc_id] = acc.get(doc_id, 0) + w * d
+
+    return {doc_id : s / (norm_q * NORMS[doc_id]) if s else 0. for doc_id, s in acc.items()}
+
+def top_k(query : dict, k : int, TF_IDF : dict, POSTINGS : dict, NORMS : dict, MAX_WEIGHTS : dict) -> list[tuple] | None:
+    """
+        **Document at a time** top `k` retrieval with [MaxScore](https://doi.org/10.1016/0306-4573(95)00020-H) pruning.
+        Query terms are sorted by their upper bound contribution: once the bounds of the
+        lightest terms summed together cannot beat the k-th best score, their posting lists
+        stop producing candidates (they are *non essential*), and a candidate is fully
+        scored on its own `TF_IDF` vector only if its bound can still enter the top `k`.
+        The k-th best score starts from the documents holding the heaviest term weights.
+        Only the positive terms are bounded: a negative weight can only lower a score,
+        it is counted by the full score of the candidates.
+
+        Returns the same `[(docID, score), ...]` of an exhaustive ranking (score desc, docID asc),
+        or `None` when less than `k` documents have a positive score: in that case the tail
+        of the ranking is made of zero (or negative) scores and the caller has to rank exhaustively.
+        `None` is also returned, without scoring, for queries with more than `TOP_K_MAX_TERMS`
+        terms: their bounds prune too little to pay the per document cost.
+    """
+    if len(query) > TOP_K_MAX_TERMS:
+        return None
+    norm_q = float(np.linalg.norm(list(query.values()))) if query else 0.
+    if norm_q == 0 or k <= 0 or k >= len(NORMS):
+        return None
+
+    terms = sorted(
+        ((w * MAX_WEIGHTS[t][0] / norm_q * (1 + 1e-9), w, t)    # slack for rounding errors
+         for t, w in query.items() if w > 0 and t in POSTINGS),
+        key=lambda x: x[0]
+    )
+    cum = list(np.cumsum([b for b, _, _ in terms]))
+
+    top = []            # min heap of (score, -docID)
+    theta = 0.          # a document can enter only with score >= theta
+    first = 0           # terms[first:] are essential
+
+    def push(doc_id, s):
+        nonlocal theta, first
+        entry = (s / (norm_q * NORMS[doc_id]), -doc_id)
+        if len(top) < k:
+            if entry[0] > 0:
+                heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+        if len(top) == k:
+            theta = top[0][0]
+            while first < len(terms) and cum[first] < theta:
+                first += 1
+
+    def full_score(doc_id):
+        return sum([query.get(t, 0) * w for t, w in TF_IDF[doc_id].items()])
+
+    seen = {MAX_WEIGHTS[t][1] for _, _, t in terms[-2 * k:]}
+    for doc_id in sorted(seen):
+        push(doc_id, full_score(doc_id))
+
+    postings = [POSTINGS[t] for _, _, t in terms]
+    ptr = [0] * len(terms)
+    cursors = [(p[0][0], i) for i, p in enumerate(postings) if i >= first]
+    heapq.heapify(cursors)
+
+    while cursors:
+        doc_id = cursors[0][0]
+        s = 0
+        while cursors and cursors[0][0] == doc_id:
+            _, i = heapq.heappop(cursors)
+            if i < first:               # no more essential, drop its cursor
+                continue
+            s += terms[i][1] * postings[i][ptr[i]][1]
+            ptr[i] += 1
+            if ptr[i] < len(postings[i]):
+                heapq.heappush(cursors, (postings[i][ptr[i]][0], i))
+
+        if s == 0 or doc_id in seen or NORMS[doc_id] == 0:
+            continue
+
+        # look the non essential terms up, from the heaviest, while the bound can beat theta
+        norm = norm_q * NORMS[doc_id]
+        vec = TF_IDF[doc_id]
+        j = first - 1
+        while j >= 0 and s / norm + cum[j] >= theta:
+            s += terms[j][1] * vec.get(terms[j][2], 0)
+            j -= 1
+        if j < 0 and s / norm >= theta:
+            push(doc_id, full_score(doc_id))
+
+    if len(top) < k:
+        return None
+    return [(-d, s) for s, d in sorted(top, reverse=True)]
+
 def add(x : dict, y : dict) -> dict:
     """
         **Sparse** implementation of add operator.
@@ -179,49 +447,85 @@ def sub(x : dict, y : dict) -> dict:
 
 def mean(vectors : list[dict]) -> dict:
     """
-        **Sparse** implementation of mean vector.
+        **Sparse** implementation of mean vector, accumulated in a single pass.
     """
     mu = dict()
 
     if (N := len(vectors)) == 0:
         return mu
-    
+
     for v in vectors:
-        mu = add(mu, v)
+        for t, w in v.items():
+            mu[t] = mu.get(t, 0) + w
 
     return mult(mu, 1/N)
     
 
 ## STRING PROCESSING
+_PUNCTUATION_TABLE = str.maketrans('', '', PUNCTUATION)
+_NORMALISATION_TABLE = str.maketrans('', '', PUNCTUATION + "'")
+_STEMMER = PorterStemmer()
+
+@lru_cache(maxsize=None)
+def stopword_set(lang : str = 'english') -> frozenset:
+    """
+        The stopwords of `lang`, loaded only once.
+    """
+    return frozenset(stopwords.words(lang))
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(token : str) -> str:
+    """
+        Porter stem of `token`, memoised.
+    """
+    return _STEMMER.stem(token)
+
 def lower_case(text: str | np.ndarray) -> np.ndarray:
     return np.char.lower(text)
 
 def remove_stopwords(text : str | np.ndarray, lang : str = 'english') -> np.ndarray:
-    stop_words = stopwords.words(lang)
+    stop_words = stopword_set(lang)
     tokens = word_tokenize(str(text))
     return np.array(' '.join([word for word in tokens if not word in stop_words]))
 
 def remove_punctuation(text: str | np.ndarray) -> np.ndarray:
-    symbols = '!"#$%&()*+-./:;<=>?@[]\\^_~`{}|\n£°'
-    for s in symbols:
-        text = np.char.replace(text, s, '')
-    text = np.char.replace(text, ',', '')
-    return text
+    return np.char.translate(text, _PUNCTUATION_TABLE)
 
 def remove_apostrophe(text : str | np.ndarray) -> np.ndarray:
     return np.char.replace(text, "'", '')
 
 def stemming(text : str | np.ndarray) -> np.ndarray:
-    stemmer = PorterStemmer()
     tokens = word_tokenize(str(text))
-    return np.array(' '.join([stemmer.stem(w) for w in tokens]))
+    return np.array(' '.join([stem(w) for w in tokens]))
+
+def normalise(text : str | np.ndarray) -> str:
+    """
+        `text` in lower case, without punctuation & apostrophes: step 1 of `tokenize`.
+    """
+    return str(text).lower().translate(_NORMALISATION_TABLE)
+
+def tokenize(text : str | np.ndarray, lang : str = 'english') -> list[str]:
+    """
+        Single pass preprocessing of `text`, it returns the same tokens of
+        `word_tokenize(str(preprocess(text)))`:
+            1. lower case & punctuation (apostrophes included) removal with one translation table.
+            2. tokenization.
+            3. stopwords removal & (memoised) stemming.
+    """
+    stop_words = stopword_set(lang)
+    tokens = []
+    for w in word_tokenize(normalise(text)):
+        if w in stop_words:
+            continue
+        if (t := stem(w).translate(_NORMALISATION_TABLE)):
+            tokens.append(t)
+    return tokens
+
+def tokenize_batch(texts : list, lang : str = 'english') -> list[list[str]]:
+    """
+        `tokenize` of each text in `texts`.
+    """
+    return [tokenize(text, lang) for text in texts]
 
 def preprocess(text: str | np.ndarray) -> np.ndarray:
-    text = lower_case(text)
-    text = remove_punctuation(text)
-    text = remove_apostrophe(text)
-    text = remove_stopwords(text)
-    text = stemming(text)
-    text = remove_punctuation(text)
-    text = remove_apostrophe(text)
-    return text
+    return np.array(' '.join(tokenize(text)))